@@ -0,0 +1,116 @@
+# Per-MP wealth and debt aggregates, mirroring calculateTotalDebt, totalOtherVagyonErtek and
+# calculateTotalWealth in frontend/app/page.tsx so the numbers match what the site shows.
+# Like the frontend, art and other valuables are read from the frontend schema's
+# vedett_mualkotas_es_gyujtemeny / egyeb_ingosag_5m_felett keys.
+
+# Order of the wealth breakdown, same as in the frontend
+BREAKDOWN_KEYS = [
+    "keszpenz",
+    "takarekbetet",
+    "bankszamla",
+    "ertekpapirok",
+    "mualkotas",
+    "egyeb_ingosag",
+    "mas_penzkoveteles",
+]
+
+
+def get_path(data, *keys):
+    # Optional chaining: data?.a?.b
+    for key in keys:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _or_zero(value):
+    # JavaScript's `value || 0` for numbers
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) and value else 0
+
+
+def sum_debts(tartozasok):
+    return sum(_or_zero(item.get("osszeg_huf")) for item in tartozasok or [] if isinstance(item, dict))
+
+
+def total_debt(mp):
+    tartozasok = get_path(mp, "vagyonyi_nyilatkozat", "tartozasok")
+    return sum_debts(get_path(tartozasok, "hitelintezettel_szembeni_tartozasok")) + sum_debts(
+        get_path(tartozasok, "maganszemelyekkel_szembeni_tartozasok")
+    )
+
+
+def other_wealth(mp):
+    # Wealth excluding properties and vehicles: (total, breakdown)
+    ingok = get_path(mp, "vagyonyi_nyilatkozat", "nagy_erteku_ingok") or {}
+    breakdown = dict.fromkeys(BREAKDOWN_KEYS, 0)
+
+    if get_path(ingok, "keszpenz"):
+        breakdown["keszpenz"] = _or_zero(get_path(ingok, "keszpenz", "osszeg_huf"))
+    if get_path(ingok, "takarekbetetben_elhelyezett_megtakaritas"):
+        breakdown["takarekbetet"] = _or_zero(
+            get_path(ingok, "takarekbetetben_elhelyezett_megtakaritas", "osszeg_huf")
+        )
+
+    hitelintezeti = get_path(ingok, "hitelintezeti_szamlakoveteles")
+    if hitelintezeti:
+        breakdown["bankszamla"] = (
+            _or_zero(hitelintezeti.get("forintban_huf"))
+            + _or_zero(hitelintezeti.get("devizaban_forinterteken_huf"))
+            + _or_zero(hitelintezeti.get("hitelintezeti_szamlakoveteles_huf"))
+        )
+
+    # Only HUF securities are counted
+    breakdown["ertekpapirok"] = sum(
+        item["nevertek"]
+        for item in get_path(ingok, "ertekpapir_vagy_egyeb_befektetes") or []
+        if isinstance(item, dict) and _or_zero(item.get("nevertek")) and item.get("penznem") == "HUF"
+    )
+    breakdown["mualkotas"] = sum(
+        _or_zero(item.get("ertek_huf"))
+        for item in get_path(ingok, "vedett_mualkotas_es_gyujtemeny") or []
+        if isinstance(item, dict)
+    )
+    breakdown["egyeb_ingosag"] = sum(
+        _or_zero(item.get("ertek_huf"))
+        for item in get_path(ingok, "egyeb_ingosag_5m_felett") or []
+        if isinstance(item, dict)
+    )
+    breakdown["mas_penzkoveteles"] = _or_zero(
+        get_path(ingok, "mas_szerzodes_alapjan_fennallo_penzkoveteles_osszege_huf")
+    )
+
+    # Add up in the frontend's order so floating point totals are identical
+    total = 0
+    for key in BREAKDOWN_KEYS:
+        total += breakdown[key]
+    return total, breakdown
+
+
+def total_wealth(mp):
+    # Other wealth plus vehicle values, excluding properties
+    total = other_wealth(mp)[0]
+    for jarmu in get_path(mp, "vagyonyi_nyilatkozat", "nagy_erteku_ingok", "gepjarmuvek") or []:
+        if isinstance(jarmu, dict):
+            total += _or_zero(jarmu.get("ertek_huf"))
+    return total
+
+
+def mp_aggregates(mp):
+    # Every precomputed value the MP table needs, flat
+    other_total, breakdown = other_wealth(mp)
+    return {
+        "source_file": mp.get("source_file"),
+        "nyilatkozattevo_nev": mp.get("nyilatkozattevo_nev"),
+        "ingatlanok_db": len(get_path(mp, "vagyonyi_nyilatkozat", "ingatlanok") or []),
+        "gepjarmuvek_db": len(
+            get_path(mp, "vagyonyi_nyilatkozat", "nagy_erteku_ingok", "gepjarmuvek") or []
+        ),
+        "keszpenz_huf": _or_zero(
+            get_path(mp, "vagyonyi_nyilatkozat", "nagy_erteku_ingok", "keszpenz", "osszeg_huf")
+        ),
+        "egyeb_vagyon_huf": other_total,
+        "osszvagyon_huf": total_wealth(mp),
+        "tartozas_huf": total_debt(mp),
+        **{f"{key}_huf": value for key, value in breakdown.items()},
+    }
@@ -0,0 +1,209 @@
+import os
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from aggregates import get_path, mp_aggregates
+
+# Flat tables built from combined.json, one row per item, keyed by source_file
+TABLE_NAMES = ["mps", "ingatlanok", "gepjarmuvek", "befektetesek", "tartozasok", "jovedelmek"]
+
+# Income and interest lists, with the key holding the position or activity in each
+INCOME_SECTIONS = [
+    ("jovedelemnyilatkozat", "aktualis_foglalkozasok", "foglalkozas_megbizas_tisztseg"),
+    ("jovedelemnyilatkozat", "elozo_3_ev_foglalkozasai", "foglalkozas_megbizas_tisztseg"),
+    ("jovedelemnyilatkozat", "alkalmi_jovedelem_2m_felett", "tevekenyseg"),
+    ("gazdasagi_erdekeltsegi_nyilatkozat", "tagsag_vagy_tisztseg_gazdalkodo_szervezetben", "tagsag_tisztseg"),
+    ("gazdasagi_erdekeltsegi_nyilatkozat", "befolyassal_biro_gazdasagi_erdekeltsegek", "tagsag_tisztseg"),
+]
+INCOME_CATEGORIES = [f"jovedelmi_kategoria_{i}" for i in range(1, 6)]
+
+# Columns coerced to numbers, anything unparseable becomes NaN
+NUMERIC_COLUMNS = {
+    "ingatlanok": ["terulet_m2", "alapterulet_m2", "tulajdoni_hanyad"],
+    "gepjarmuvek": ["gyartasi_ev", "ertek_huf"],
+    "befektetesek": ["nevertek"],
+    "tartozasok": ["osszeg_huf"],
+    "jovedelmek": ["jovedelem_huf", "tulajdoni_hanyad"],
+}
+
+
+def _items(mp, *keys):
+    return [item for item in get_path(mp, *keys) or [] if isinstance(item, dict)]
+
+
+def flatten_declarations(mps):
+    # One pass over the nested declarations, returning a list of row dicts per table
+    rows = {name: [] for name in TABLE_NAMES}
+    for mp in mps:
+        source_file = mp.get("source_file")
+        rows["mps"].append(mp_aggregates(mp))
+
+        for item in _items(mp, "vagyonyi_nyilatkozat", "ingatlanok"):
+            rows["ingatlanok"].append({"source_file": source_file, **item})
+        for item in _items(mp, "vagyonyi_nyilatkozat", "nagy_erteku_ingok", "gepjarmuvek"):
+            rows["gepjarmuvek"].append({"source_file": source_file, **item})
+        for item in _items(mp, "vagyonyi_nyilatkozat", "nagy_erteku_ingok", "ertekpapir_vagy_egyeb_befektetes"):
+            rows["befektetesek"].append({"source_file": source_file, **item})
+
+        for kind, key in [
+            ("hitelintezet", "hitelintezettel_szembeni_tartozasok"),
+            ("maganszemely", "maganszemelyekkel_szembeni_tartozasok"),
+        ]:
+            for item in _items(mp, "vagyonyi_nyilatkozat", "tartozasok", key):
+                rows["tartozasok"].append(
+                    {
+                        "source_file": source_file,
+                        "tipus": kind,
+                        "hitelezo": item.get("hitelező"),
+                        "osszeg_huf": item.get("osszeg_huf"),
+                        "penznem": item.get("penznem"),
+                    }
+                )
+
+        for declaration, section, position_key in INCOME_SECTIONS:
+            for item in _items(mp, declaration, section):
+                jovedelem = item.get("jovedelem") if isinstance(item.get("jovedelem"), dict) else {}
+                rows["jovedelmek"].append(
+                    {
+                        "source_file": source_file,
+                        "szakasz": section,
+                        "tisztseg": item.get(position_key),
+                        "szervezet": item.get("szervezet") or item.get("gazdasagi_tarsasag_neve"),
+                        "tulajdoni_hanyad": item.get("tulajdoni_hanyad"),
+                        "dijazas_nelkuli": bool(jovedelem.get("dijazas_nelkuli")),
+                        **{key: bool(jovedelem.get(key)) for key in INCOME_CATEGORIES},
+                        "jovedelem_huf": jovedelem.get("jovedelem_huf"),
+                    }
+                )
+    return rows
+
+
+def build_tables(mps, release=None):
+    # DataFrames of the flattened rows; with a release label every table gets a release column
+    tables = {}
+    for name, rows in flatten_declarations(mps).items():
+        table = pd.DataFrame.from_records(rows)
+        if table.empty:
+            table = pd.DataFrame(columns=["source_file"])
+        for column in NUMERIC_COLUMNS.get(name, []):
+            if column in table:
+                table[column] = pd.to_numeric(table[column], errors="coerce")
+        if release is not None:
+            table.insert(0, "release", release)
+        tables[name] = table
+
+    # Income category as a number (0 if none is marked), from the five boolean columns at once
+    jovedelmek = tables["jovedelmek"]
+    if not jovedelmek.empty:
+        flags = jovedelmek[INCOME_CATEGORIES].to_numpy(dtype=bool)
+        jovedelmek["kategoria"] = np.where(flags.any(axis=1), flags.argmax(axis=1) + 1, 0)
+    return tables
+
+
+def load_tables(sources):
+    # sources is the path of a combined.json, or a {release: path} dict to stack several releases
+    if isinstance(sources, (str, os.PathLike)):
+        with open(sources, "r", encoding="utf-8") as f:
+            return build_tables(json.load(f))
+
+    per_release = []
+    for release, path in sources.items():
+        with open(path, "r", encoding="utf-8") as f:
+            per_release.append(build_tables(json.load(f), release=release))
+    return {
+        name: pd.concat([tables[name] for tables in per_release], ignore_index=True)
+        for name in TABLE_NAMES
+    }
+
+
+def ranking(tables, column, n=20, ascending=False):
+    # Top n MPs by a column of the mps table, with their rank (ties share the best rank)
+    mps = tables["mps"]
+    group = mps.groupby("release")[column] if "release" in mps else mps[column]
+    ranked = mps.assign(rang=group.rank(ascending=ascending, method="min").astype(int))
+    keys = ["release", "rang"] if "release" in mps else ["rang"]
+    ranked = ranked.sort_values(keys, kind="stable")
+    if "release" in mps:
+        return ranked.groupby("release").head(n)
+    return ranked.head(n)
+
+
+def percentiles(tables, columns, q=(0.1, 0.25, 0.5, 0.75, 0.9, 0.99)):
+    # Percentiles of columns of the mps table, per release if there are several
+    mps = tables["mps"]
+    if "release" in mps:
+        result = mps.groupby("release")[list(columns)].quantile(list(q))
+    else:
+        result = mps[list(columns)].quantile(list(q))
+    # 0.5 -> p50
+    return result.rename(index=lambda value: f"p{value * 100:g}" if isinstance(value, float) else value)
+
+
+def group_totals(tables, table_name, by, value=None):
+    # Row count, number of distinct MPs and (optionally) the sum of a value column per group
+    table = tables[table_name]
+    keys = ["release", by] if "release" in table else [by]
+    aggregations = {"db": ("source_file", "size"), "kepviselok": ("source_file", "nunique")}
+    if value is not None:
+        aggregations[f"{value}_osszesen"] = (value, "sum")
+    return table.groupby(keys, dropna=False).agg(**aggregations).sort_values("db", ascending=False)
+
+
+def parse_sources(inputs):
+    # PATH or RELEASE=PATH arguments
+    if len(inputs) == 1 and "=" not in inputs[0]:
+        return inputs[0]
+    sources = {}
+    for item in inputs:
+        release, _, path = item.rpartition("=")
+        sources[release or os.path.splitext(os.path.basename(path))[0]] = path
+    return sources
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rankings, percentiles and group-bys over the combined declarations"
+    )
+    parser.add_argument(
+        "--input",
+        nargs="+",
+        default=[os.path.join("jsons", "combined.json")],
+        help="Combined JSON to analyze, or several RELEASE=PATH arguments to compare releases (default: jsons/combined.json)",
+    )
+    parser.add_argument("--top", type=int, default=20, help="Number of MPs to list with --by (default: 20)")
+    parser.add_argument("--by", help="Rank MPs by a column of the mps table, e.g. osszvagyon_huf")
+    parser.add_argument("--ascending", action="store_true", help="Rank from the smallest value")
+    parser.add_argument("--percentiles", nargs="+", metavar="COLUMN", help="Percentiles of mps table columns")
+    parser.add_argument(
+        "--group-by",
+        metavar="TABLE.COLUMN",
+        help="Count rows and MPs per value, e.g. gepjarmuvek.marka or ingatlanok.telepules",
+    )
+    parser.add_argument("--value", help="Column to sum per group with --group-by, e.g. ertek_huf")
+    parser.add_argument("--csv-dir", help="Write every flat table as CSV to this directory")
+    args = parser.parse_args()
+
+    tables = load_tables(parse_sources(args.input))
+    print(", ".join(f"{name}: {len(tables[name])} rows" for name in TABLE_NAMES))
+
+    with pd.option_context("display.max_rows", None, "display.width", 200, "display.float_format", "{:,.0f}".format):
+        if args.by:
+            columns = [c for c in ["release", "rang", "source_file", "nyilatkozattevo_nev", args.by] if c in tables["mps"]]
+            print(f"\n🏆 Top {args.top} by {args.by}:")
+            print(ranking(tables, args.by, args.top, args.ascending)[columns].to_string(index=False))
+        if args.percentiles:
+            print("\n📊 Percentiles:")
+            print(percentiles(tables, args.percentiles).to_string())
+        if args.group_by:
+            table_name, _, column = args.group_by.partition(".")
+            print(f"\n📦 {args.group_by}:")
+            print(group_totals(tables, table_name, column, args.value).head(args.top).to_string())
+
+    if args.csv_dir:
+        os.makedirs(args.csv_dir, exist_ok=True)
+        for name, table in tables.items():
+            table.to_csv(os.path.join(args.csv_dir, f"{name}.csv"), index=False)
+        print(f"💾 Saved {len(tables)} tables to {args.csv_dir}")
@@ -0,0 +1,297 @@
+import io
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from combine import combine_json_files
+from export import summary_columns
+from extract import parse_llm_response
+from split import extract_mp_page_numbers, split_pdf, pymupdf
+
+# Fixtures shipped with the repo: 214 sub-PDFs of the 20250228 gazette and their extracted JSONs
+FIXTURE_PDFS = sorted(glob.glob(os.path.join("temp", "mp_*.pdf")))
+FIXTURE_JSONS = sorted(glob.glob(os.path.join("jsons", "mp_*.json")))
+
+DEFAULT_RESULTS = "bench_results.jsonl"
+
+# Benchmarks that share a fixture, which is only built if one of them is selected
+SPLIT_BENCHMARKS = ["split.extract_mp_page_numbers", "split.split_pdf", "split.split_pdf_unchanged"]
+COMBINE_BENCHMARKS = ["combine.combine_json_files", "combine.combine_json_files_unchanged"]
+
+
+@contextmanager
+def working_directory(path):
+    # combine.py works on ./jsons, so it is benchmarked from inside the fixture directory
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def build_master_pdf(sub_pdfs, scale, output_path):
+    # Synthetic gazette: the sub-PDFs concatenated `scale` times
+    if pymupdf is not None:
+        with pymupdf.open() as master:
+            for _ in range(scale):
+                for path in sub_pdfs:
+                    with pymupdf.open(path) as sub_doc:
+                        master.insert_pdf(sub_doc)
+            master.save(output_path, garbage=3, deflate=True)
+        return
+    writer = PdfWriter()
+    readers = [PdfReader(path) for path in sub_pdfs]
+    for _ in range(scale):
+        for reader in readers:
+            for page in reader.pages:
+                writer.add_page(page)
+    with open(output_path, "wb") as f:
+        writer.write(f)
+
+
+def build_json_dir(json_paths, scale, output_dir):
+    # Synthetic jsons/ directory: every fixture JSON `scale` times, hard-linked where possible
+    os.makedirs(output_dir, exist_ok=True)
+    for copy in range(scale):
+        for path in json_paths:
+            name = os.path.basename(path)
+            if copy:
+                name = f"{name[:-5]}_x{copy:03d}.json"
+            target = os.path.join(output_dir, name)
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copyfile(path, target)
+
+
+def load_responses(json_paths):
+    # Model responses as the extraction sees them: the clean JSON, the JSON wrapped in a
+    # ```json fence with prose around it, and the JSON cut off at 70% as at the token limit
+    real = []
+    for path in json_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            real.append(f.read())
+    fenced = [f"Here is the extracted data:\n```json\n{text}\n```\nLet me know if you need anything else." for text in real]
+    truncated = [text[: int(len(text) * 0.7)] for text in real]
+    return {"real": real, "fenced": fenced, "truncated": truncated}
+
+
+def time_runs(function, repeat, setup=None):
+    # Run setup (untimed) and function `repeat` times; print output is discarded
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_benchmarks(scales, repeat, pdf_mps, only=None):
+    # {name: {scale, items, min, median}} for every benchmark and scale
+    results = {}
+
+    def selected(*names):
+        # Whether one of the benchmarks is selected by --only (a substring of its name)
+        return not only or any(pattern in name for pattern in only for name in names)
+
+    def record(name, scale, items, timings):
+        key = f"{name}@{scale}x"
+        results[key] = {
+            "scale": scale,
+            "items": items,
+            "min": min(timings),
+            "median": statistics.median(timings),
+        }
+        print(f"  {key:<48} {min(timings):>9.4f}s  ({items} items)")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        responses = load_responses(FIXTURE_JSONS)
+        mps = [json.loads(text) for text in responses["real"]]
+
+        for scale in scales:
+            print(f"\n⏱️  Scale {scale}x")
+
+            # Page scanning and splitting, on `pdf_mps` sub-PDFs concatenated `scale` times
+            if selected(*SPLIT_BENCHMARKS):
+                master_path = os.path.join(workdir, f"master_{scale}x.pdf")
+                build_master_pdf(FIXTURE_PDFS[:pdf_mps], scale, master_path)
+                mp_count = pdf_mps * scale
+                split_dir = os.path.join(workdir, f"split_{scale}x")
+
+                if selected("split.extract_mp_page_numbers"):
+                    timings = time_runs(lambda: extract_mp_page_numbers(master_path), repeat)
+                    record("split.extract_mp_page_numbers", scale, mp_count, timings)
+                if selected("split.split_pdf"):
+                    timings = time_runs(
+                        lambda: split_pdf(master_path, output_dir=split_dir, full=True),
+                        repeat,
+                        setup=lambda: shutil.rmtree(split_dir, ignore_errors=True),
+                    )
+                    record("split.split_pdf", scale, mp_count, timings)
+                if selected("split.split_pdf_unchanged"):
+                    # Re-split of an unchanged gazette: only scanning and hashing
+                    if not os.path.isdir(split_dir):
+                        time_runs(lambda: split_pdf(master_path, output_dir=split_dir), 1)
+                    timings = time_runs(lambda: split_pdf(master_path, output_dir=split_dir), repeat)
+                    record("split.split_pdf_unchanged", scale, mp_count, timings)
+                os.remove(master_path)
+                shutil.rmtree(split_dir, ignore_errors=True)
+
+            # Response parsing, over the fixture JSONs `scale` times
+            for variant, texts in responses.items():
+                name = f"extract.parse_llm_response[{variant}]"
+                if selected(name):
+                    def parse_all(texts=texts):
+                        for _ in range(scale):
+                            for text in texts:
+                                parse_llm_response(text)
+                    timings = time_runs(parse_all, repeat)
+                    record(name, scale, len(texts) * scale, timings)
+
+            # Combining a jsons/ directory of 214 * scale files, from scratch and with nothing changed
+            if selected(*COMBINE_BENCHMARKS):
+                combine_dir = os.path.join(workdir, f"combine_{scale}x")
+                build_json_dir(FIXTURE_JSONS, scale, os.path.join(combine_dir, "jsons"))
+                with working_directory(combine_dir):
+                    if selected("combine.combine_json_files"):
+                        timings = time_runs(lambda: combine_json_files(full=True), repeat)
+                        record("combine.combine_json_files", scale, len(FIXTURE_JSONS) * scale, timings)
+                    if selected("combine.combine_json_files_unchanged"):
+                        # Nothing changed since the previous combine
+                        if not os.path.exists(os.path.join("jsons", "combined.json")):
+                            time_runs(lambda: combine_json_files(full=True), 1)
+                        timings = time_runs(combine_json_files, repeat)
+                        record("combine.combine_json_files_unchanged", scale, len(FIXTURE_JSONS) * scale, timings)
+                shutil.rmtree(combine_dir)
+
+            # Aggregates and columns of the frontend summary
+            if selected("export.summary_columns"):
+                scaled_mps = mps * scale
+                timings = time_runs(lambda: summary_columns(scaled_mps), repeat)
+                record("export.summary_columns", scale, len(scaled_mps), timings)
+
+    return results
+
+
+def git_revision():
+    # Short commit hash, with "-dirty" if tracked files have uncommitted changes
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if status else commit
+
+
+def load_history(results_path):
+    if not os.path.exists(results_path):
+        return []
+    with open(results_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_baseline(history, revision, compare=None):
+    # The run to compare with: the latest run of the given commit, or else the latest run of another commit
+    for run in reversed(history):
+        if compare is not None:
+            if run["revision"].startswith(compare):
+                return run
+        elif run["revision"] != revision:
+            return run
+    return None
+
+
+def compare_results(results, baseline, threshold):
+    # Print the change of the best time of every benchmark against the baseline (the minimum is
+    # the least noisy estimate); return the names that got slower
+    regressions = []
+    print(f"\n📈 Compared with {baseline['revision']} ({baseline['time']}):")
+    for key, result in results.items():
+        previous = baseline["results"].get(key)
+        if previous is None:
+            continue
+        change = result["min"] / previous["min"] - 1 if previous["min"] else 0
+        flag = ""
+        if change > threshold:
+            flag = " ⚠️ slower"
+            regressions.append(key)
+        elif change < -threshold:
+            flag = " 🚀 faster"
+        print(f"  {key:<48} {previous['min']:>9.4f}s -> {result['min']:>9.4f}s  {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the split, parse, combine and export hot paths offline on synthetic data built from ./temp and ./jsons"
+    )
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="Scale factors to run (default: 1 10 100)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the best time is reported and compared (default: 3)")
+    parser.add_argument(
+        "--pdf-mps",
+        type=int,
+        default=2,
+        help="Sub-PDFs in the 1x synthetic gazette for the split benchmarks (default: 2, so 100x is about the size of a real gazette)",
+    )
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="Only run benchmarks whose name contains one of these strings")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help=f"JSON Lines file the runs are appended to (default: {DEFAULT_RESULTS})")
+    parser.add_argument("--no-save", action="store_true", help="Do not append this run to the results file")
+    parser.add_argument("--compare", metavar="COMMIT", help="Compare with the latest run of this commit (default: the latest run of another commit)")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown reported as a regression (default: 0.1)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any benchmark regressed")
+    args = parser.parse_args()
+
+    if not FIXTURE_PDFS or not FIXTURE_JSONS:
+        print("Error: run from the data_extraction directory, the fixtures in ./temp and ./jsons are needed")
+        sys.exit(1)
+
+    revision = git_revision()
+    print(f"Benchmarking {revision} at scales {', '.join(f'{scale}x' for scale in args.scales)}")
+    results = run_benchmarks(args.scales, args.repeat, args.pdf_mps, args.only)
+
+    history = load_history(args.results)
+    baseline = find_baseline(history, revision, args.compare)
+    regressions = compare_results(results, baseline, args.threshold) if baseline else []
+
+    if not args.no_save:
+        run = {
+            "revision": revision,
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.node(),
+            "repeat": args.repeat,
+            "pdf_mps": args.pdf_mps,
+            "results": results,
+        }
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(run) + "\n")
+        print(f"💾 Saved results to {args.results}")
+
+    if regressions:
+        print(f"⚠️ {len(regressions)} benchmarks are more than {args.threshold:.0%} slower")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: shared files are merged but writes are not serialized between processes
+    fcntl = None
+
+
+# Cache entries are named by their key; other files in the directory are not entries
+ENTRY_NAME_PATTERN = re.compile(r"[0-9a-f]{64}\.json")
+
+
+# Hash a file's bytes without loading it into memory at once
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Serialize the writes of the processes sharing a file (extract.py --queue workers)
+@contextmanager
+def file_lock(lock_path):
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Hash everything besides the PDF that determines the model's answer
+def extraction_fingerprint(prompt, model_name, generation_config):
+    payload = json.dumps(
+        {"prompt": prompt, "model": model_name, "generation_config": generation_config},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    # On-disk cache of parsed extraction results, keyed by PDF content and extraction settings.
+    # Entries are evicted least-recently-used first once the cache grows past max_bytes.
+    def __init__(self, cache_dir="./cache", max_bytes=500 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    def key(self, pdf_path, fingerprint):
+        return hashlib.sha256(f"{file_sha256(pdf_path)}:{fingerprint}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _entries(self):
+        # (mtime, path, size) of every cache entry
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if ENTRY_NAME_PATTERN.fullmatch(name):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # Touch the entry so it counts as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        # Unique per process and thread, as worker processes may share the cache directory
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        size = os.path.getsize(tmp_path)
+
+        with self.lock:
+            if os.path.exists(path):
+                self.total_bytes -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Remove the least recently used entries until the cache fits again
+        for _, path, size in sorted(self._entries()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
@@ -1,10 +1,34 @@
 import os
 import json
 import glob
+import hashlib
+import argparse
 from pathlib import Path
 
+# Manifest of the inputs that went into combined.json. The leading dot keeps it out of the *.json glob.
+MANIFEST_NAME = ".combined_manifest.json"
 
-def combine_json_files():
+
+def load_manifest(manifest_path, output_path):
+    # Return the previous manifest, or an empty one if combined.json changed since it was written
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        stat = os.stat(output_path)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"files": {}, "output": None}
+    if manifest.get("output") != {"mtime": stat.st_mtime, "size": stat.st_size}:
+        return {"files": {}, "output": None}
+    return manifest
+
+
+def serialize_record(data):
+    # Same bytes json.dump(combined_data, indent=2) writes for one element of the list
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    return ("  " + text.replace("\n", "\n  ")).encode("utf-8")
+
+
+def combine_json_files(full=False):
     # Get all JSON files in the jsons directory
     json_pattern = os.path.join("jsons", "*.json")
     json_files = glob.glob(json_pattern)
@@ -16,32 +40,96 @@ def combine_json_files():
         print("No JSON files found to combine.")
         return
 
-    combined_data = []
+    # Create the output directory if it doesn't exist
+    output_dir = "jsons"
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, "combined.json")
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+
+    # Reuse the records of unchanged inputs from the previous combined.json
+    manifest = {"files": {}, "output": None} if full else load_manifest(manifest_path, output_path)
+    previous_files = manifest["files"]
+    previous_output = None
+
+    records = []  # (file_path, manifest entry, serialized record or None to copy the old slice)
+    changed_count = 0
 
-    # Read each JSON file and add its content to our combined data
     for file_path in sorted(json_files):
+        stat = os.stat(file_path)
+        entry = previous_files.get(file_path)
+
+        # Unchanged mtime and size: trust the previous record without reading the file
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            records.append((file_path, entry, None))
+            continue
+
         try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                data = json.load(file)
-                # Add file name without extension as the source
-                mp_id = Path(file_path).stem
-                data["source_file"] = mp_id
-                combined_data.append(data)
-                print(f"Processed {file_path}")
+            with open(file_path, "rb") as file:
+                raw = file.read()
+            sha256 = hashlib.sha256(raw).hexdigest()
+
+            # Touched but identical content: keep the previous record
+            if entry and entry["sha256"] == sha256:
+                entry = dict(entry, mtime=stat.st_mtime, size=stat.st_size)
+                records.append((file_path, entry, None))
+                continue
+
+            data = json.loads(raw.decode("utf-8"))
+            # Add file name without extension as the source
+            mp_id = Path(file_path).stem
+            data["source_file"] = mp_id
+            entry = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256}
+            records.append((file_path, entry, serialize_record(data)))
+            changed_count += 1
+            print(f"Processed {file_path}")
         except Exception as e:
             print(f"Error processing {file_path}: {e}")
 
-    # Create the output directory if it doesn't exist
-    output_dir = "jsons"
-    os.makedirs(output_dir, exist_ok=True)
+    # Nothing added, changed or removed: combined.json is already up to date
+    if changed_count == 0 and [r[0] for r in records] == list(previous_files):
+        print(f"combined.json is up to date ({len(records)} records), nothing to do.")
+        return
+
+    # Patch combined.json: copy the byte slices of unchanged records and splice in the changed ones
+    if changed_count < len(records):
+        with open(output_path, "rb") as f:
+            previous_output = f.read()
+
+    parts = []
+    files = {}
+    offset = len(b"[\n")
+    for file_path, entry, serialized in records:
+        if serialized is None:
+            serialized = previous_output[entry["offset"] : entry["offset"] + entry["length"]]
+        files[file_path] = dict(entry, offset=offset, length=len(serialized))
+        parts.append(serialized)
+        offset += len(serialized) + len(b",\n")
+    output = b"[\n" + b",\n".join(parts) + b"\n]" if parts else b"[]"
 
     # Write the combined data to a single JSON file
-    output_path = os.path.join(output_dir, "combined.json")
-    with open(output_path, "w", encoding="utf-8") as outfile:
-        json.dump(combined_data, outfile, ensure_ascii=False, indent=2)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as outfile:
+        outfile.write(output)
+    os.replace(tmp_path, output_path)
+
+    stat = os.stat(output_path)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"files": files, "output": {"mtime": stat.st_mtime, "size": stat.st_size}}, f
+        )
 
-    print(f"\nSuccessfully combined {len(combined_data)} JSON files into {output_path}")
+    print(
+        f"\nSuccessfully combined {len(records)} JSON files into {output_path} "
+        f"({changed_count} re-read, {len(records) - changed_count} reused)"
+    )
 
 
 if __name__ == "__main__":
-    combine_json_files()
+    parser = argparse.ArgumentParser(description="Combine the per-MP JSON files into combined.json")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the manifest and rebuild combined.json from every input file",
+    )
+    args = parser.parse_args()
+    combine_json_files(full=args.full)
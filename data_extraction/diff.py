@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import glob
+import argparse
+import unicodedata
+from collections import Counter, defaultdict
+
+from aggregates import mp_aggregates
+from export import write_json
+from split import load_split_manifest, sub_pdf_content_hash
+
+# Fields that differ between releases without the declaration changing
+IGNORED_KEYS = {"source_file"}
+
+# Totals reported for every changed MP, so the change feed shows the effect at a glance
+TOTAL_KEYS = ["osszvagyon_huf", "tartozas_huf", "ingatlanok_db", "gepjarmuvek_db"]
+
+TITLE_PATTERN = re.compile(r"^(dr|prof|ifj|id)\.?\s+")
+
+
+def normalize_name(name):
+    # "Dr. Gurmai  Zita" and "dr GURMAI Zita" -> "gurmai zita"
+    if not isinstance(name, str):
+        return ""
+    name = unicodedata.normalize("NFKD", name.casefold())
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    name = " ".join(re.sub(r"[^\w\s]", " ", name.replace(".", ". ")).split())
+    while TITLE_PATTERN.match(name):
+        name = TITLE_PATTERN.sub("", name, count=1)
+    return name
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+def diff_values(old, new, path=""):
+    # Structural diff: dicts are compared key by key, lists as multisets of their items
+    # (so reordering is not a change) and anything else by value
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in list(old) + [key for key in new if key not in old]:
+            if key in IGNORED_KEYS:
+                continue
+            changes.extend(diff_values(old.get(key), new.get(key), f"{path}.{key}" if path else key))
+        return changes
+
+    if isinstance(old, list) and isinstance(new, list):
+        old_items = Counter(_canonical(item) for item in old)
+        new_items = Counter(_canonical(item) for item in new)
+        added = [json.loads(item) for item in (new_items - old_items).elements()]
+        removed = [json.loads(item) for item in (old_items - new_items).elements()]
+        if not added and not removed:
+            return []
+        change = {"path": path}
+        if added:
+            change["added"] = added
+        if removed:
+            change["removed"] = removed
+        return [change]
+
+    if old != new:
+        return [{"path": path, "old": old, "new": new}]
+    return []
+
+
+def match_mps(old_mps, new_mps):
+    # Pair MPs by normalized name. Some MPs have several declarations in a gazette,
+    # so namesakes are paired with the previous record they differ least from.
+    old_by_name = defaultdict(list)
+    for mp in old_mps:
+        old_by_name[normalize_name(mp.get("nyilatkozattevo_nev"))].append(mp)
+
+    pairs = []
+    for mp in new_mps:
+        candidates = old_by_name.get(normalize_name(mp.get("nyilatkozattevo_nev")))
+        if not candidates:
+            pairs.append((None, mp))
+            continue
+        closest = candidates[0]
+        if len(candidates) > 1:
+            closest = min(candidates, key=lambda old: len(diff_values(old, mp)))
+        candidates.remove(closest)
+        pairs.append((closest, mp))
+    pairs.extend((mp, None) for candidates in old_by_name.values() for mp in candidates)
+    return pairs
+
+
+def pdf_hashes(pdf_dir):
+    # {source_file: page content hash} of the sub-PDFs in a split.py output directory, or None
+    # for a file that can't be read. The bytes of a sub-PDF change whenever the gazette is
+    # re-saved or split in the other mode, but its content hash doesn't. The hashes of the split
+    # manifest are used where there is one; other sub-PDFs are hashed the same way, so the
+    # hashes of two releases are always comparable.
+    if not pdf_dir:
+        return {}
+    manifest_mps = (load_split_manifest(pdf_dir) or {}).get("mps", {})
+    hashes = {}
+    for path in sorted(glob.glob(os.path.join(pdf_dir, "mp_*.pdf"))):
+        file_name = os.path.basename(path)
+        entry = manifest_mps.get(file_name)
+        hashes[os.path.splitext(file_name)[0]] = entry["sha256"] if entry else sub_pdf_content_hash(path)
+    return hashes
+
+
+def changed_pdfs(old_hashes, new_hashes):
+    # Sub-PDFs of the new release whose content appears nowhere in the previous one
+    known = {sha256 for sha256 in old_hashes.values() if sha256}
+    return [source_file for source_file, sha256 in new_hashes.items() if not sha256 or sha256 not in known]
+
+
+def diff_releases(old_mps, new_mps, old_hashes=None, new_hashes=None):
+    old_hashes = old_hashes or {}
+    new_hashes = new_hashes or {}
+    summary = Counter(added=0, removed=0, changed=0, unchanged=0)
+    entries = []
+
+    for old, new in match_mps(old_mps, new_mps):
+        mp = new or old
+        entry = {
+            "nyilatkozattevo_nev": mp.get("nyilatkozattevo_nev"),
+            "source_file": new.get("source_file") if new else None,
+            "previous_source_file": old.get("source_file") if old else None,
+        }
+
+        if old is None or new is None:
+            entry["status"] = "added" if old is None else "removed"
+        else:
+            changes = diff_values(old, new)
+            if old_hashes and new_hashes:
+                old_hash = old_hashes.get(old.get("source_file"))
+                entry["pdf_changed"] = not old_hash or old_hash != new_hashes.get(new.get("source_file"))
+            if not changes and not entry.get("pdf_changed"):
+                summary["unchanged"] += 1
+                continue
+            entry["status"] = "changed"
+            old_totals, new_totals = mp_aggregates(old), mp_aggregates(new)
+            entry["totals"] = {
+                key: [old_totals[key], new_totals[key]]
+                for key in TOTAL_KEYS
+                if old_totals[key] != new_totals[key]
+            }
+            entry["changes"] = changes
+
+        summary[entry["status"]] += 1
+        entries.append(entry)
+
+    return {"summary": dict(summary), "mps": entries}
+
+
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare two releases of the declarations and write a change log"
+    )
+    parser.add_argument("--old", help="combined.json of the previous release")
+    parser.add_argument(
+        "--new",
+        default=os.path.join("jsons", "combined.json"),
+        help="combined.json of the new release (default: jsons/combined.json)",
+    )
+    parser.add_argument("--old-pdfs", help="Sub-PDF directory of the previous release")
+    parser.add_argument("--new-pdfs", help="Sub-PDF directory of the new release, e.g. ./temp")
+    parser.add_argument(
+        "--release",
+        default="latest",
+        help="Name of the new release, e.g. the gazette date 20250228, used as the change log file name (default: latest)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="changes",
+        help="Directory to write the change log to (default: ./changes)",
+    )
+    args = parser.parse_args()
+
+    old_hashes = pdf_hashes(args.old_pdfs)
+    new_hashes = pdf_hashes(args.new_pdfs)
+    reextract = changed_pdfs(old_hashes, new_hashes) if old_hashes and new_hashes else None
+
+    if args.old:
+        changelog = diff_releases(load_json(args.old), load_json(args.new), old_hashes, new_hashes)
+    else:
+        # Only the PDFs are compared, e.g. before the new release is extracted
+        changelog = {"summary": {}, "mps": []}
+    changelog = {"version": 1, "release": args.release, "previous": args.old, **changelog}
+    if reextract is not None:
+        changelog["reextract"] = reextract
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, f"{args.release}.json")
+    write_json(output_path, changelog)
+
+    summary = changelog["summary"]
+    if summary:
+        print(
+            f"➕ {summary['added']} added, ➖ {summary['removed']} removed, "
+            f"✏️  {summary['changed']} changed, {summary['unchanged']} unchanged"
+        )
+        for entry in changelog["mps"]:
+            if entry["status"] == "changed":
+                paths = ", ".join(change["path"] for change in entry["changes"]) or "PDF only"
+                print(f"  {entry['nyilatkozattevo_nev']}: {paths}")
+    if reextract is not None:
+        print(f"📄 {len(reextract)} of {len(new_hashes)} sub-PDFs changed and need extraction")
+    print(f"💾 Saved change log to {output_path}")
@@ -0,0 +1,88 @@
+import os
+import json
+import argparse
+
+from aggregates import mp_aggregates
+
+# Minified JSON: no whitespace between tokens
+COMPACT = {"ensure_ascii": False, "separators": (",", ":")}
+
+
+def compact_number(value):
+    # 5000000.0 -> 5000000, saves bytes in the columns
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **COMPACT)
+    os.replace(tmp_path, path)
+
+
+def summary_columns(mps):
+    # One column per aggregate, one row per MP, in the order of the input
+    rows = [mp_aggregates(mp) for mp in mps]
+    return {key: [compact_number(row[key]) for row in rows] for key in rows[0]} if rows else {}
+
+
+def export_dataset(input_path, output_dir):
+    with open(input_path, "r", encoding="utf-8") as f:
+        mps = json.load(f)
+
+    columns = summary_columns(mps)
+
+    os.makedirs(os.path.join(output_dir, "mp"), exist_ok=True)
+    summary_path = os.path.join(output_dir, "summary.json")
+    write_json(
+        summary_path,
+        {
+            "version": 1,
+            "count": len(mps),
+            # Full declaration of an MP, to be loaded when its row is opened
+            "detail_path": "mp/{source_file}.json",
+            "columns": columns,
+        },
+    )
+
+    # Per-MP detail files, minified. Files of MPs that are no longer in the input (dropped or
+    # renamed since the last export) are removed, so they are not published.
+    detail_dir = os.path.join(output_dir, "mp")
+    detail_names = set()
+    for mp in mps:
+        detail_name = f"{mp['source_file']}.json"
+        write_json(os.path.join(detail_dir, detail_name), mp)
+        detail_names.add(detail_name)
+    removed = sorted(name for name in os.listdir(detail_dir) if name.endswith(".json") and name not in detail_names)
+    for name in removed:
+        os.remove(os.path.join(detail_dir, name))
+
+    input_size = os.path.getsize(input_path)
+    summary_size = os.path.getsize(summary_path)
+    print(f"💾 Saved summary of {len(mps)} MPs to {summary_path}")
+    print(f"💾 Saved {len(mps)} detail files to {detail_dir}")
+    if removed:
+        print(f"🗑️ Removed {len(removed)} detail files of MPs no longer in the input: {', '.join(removed)}")
+    print(
+        f"Summary is {summary_size / 1024:.1f} KB instead of {input_size / 1024:.1f} KB for the full dataset"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the combined declarations as a compact columnar summary plus per-MP detail files"
+    )
+    parser.add_argument(
+        "--input",
+        default=os.path.join("jsons", "combined.json"),
+        help="Combined JSON to export (default: jsons/combined.json)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=os.path.join("..", "frontend", "public", "data"),
+        help="Directory to write summary.json and mp/*.json to (default: ../frontend/public/data)",
+    )
+    args = parser.parse_args()
+    export_dataset(args.input, args.output_dir)
@@ -5,71 +5,385 @@ import argparse
 import glob
 import re
 import base64
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 import google.generativeai as genai
 from dotenv import load_dotenv
+from cache import ExtractionCache, extraction_fingerprint, file_lock
+from uploads import UploadRegistry, MockUploadAPI
+from pdftext import extract_declaration_text, find_sections, write_section_pdfs
+from jsonstream import IncrementalJSONParser, parse_json_stream
+from split import load_split_manifest
+from metrics import metrics
+from normalize import normalize_declaration
+from jobs import JobQueue, DEFAULT_QUEUE, default_worker_id
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure the parser
-parser = argparse.ArgumentParser(
-    description="Extract MP data from pre-split PDF declarations"
-)
-parser.add_argument(
-    "--print",
-    action="store_true",
-    help="Print results to console instead of saving to file",
-)
-parser.add_argument(
-    "--limit", type=int, default=None, help="Limit the number of MPs to process"
-)
-# Add model selection arguments (mutually exclusive)
-model_group = parser.add_mutually_exclusive_group()
-model_group.add_argument(
-    "--gemini", action="store_true", help="Use Google Gemini API (default)"
-)
-model_group.add_argument(
-    "--openai", action="store_true", help="Use OpenAI API instead of Google Gemini"
-)
-args = parser.parse_args()
-
-# Determine which API to use (default to Gemini if not specified)
-use_openai = args.openai
-use_gemini = (
-    not use_openai
-)  # Use Gemini by default unless OpenAI is specifically requested
-
-# Load API keys based on the chosen API
-if use_gemini:
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        print("Error: GOOGLE_API_KEY not found in .env file")
-        print("Please add it to your .env file as: GOOGLE_API_KEY=your_api_key_here")
-        sys.exit(1)
+def build_arg_parser():
+    # Configure the parser
+    parser = argparse.ArgumentParser(
+        description="Extract MP data from pre-split PDF declarations"
+    )
+    parser.add_argument(
+        "--print",
+        action="store_true",
+        help="Print results to console instead of saving to file",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=None, help="Limit the number of MPs to process"
+    )
+    # Add model selection arguments (mutually exclusive)
+    model_group = parser.add_mutually_exclusive_group()
+    model_group.add_argument(
+        "--gemini", action="store_true", help="Use Google Gemini API (default)"
+    )
+    model_group.add_argument(
+        "--openai", action="store_true", help="Use OpenAI API instead of Google Gemini"
+    )
+    model_group.add_argument(
+        "--fake",
+        action="store_true",
+        help="Use a local fake backend that serves canned responses (no API key needed)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Maximum number of extraction requests in flight at once",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="./jsons",
+        help="Directory to write the per-MP JSON files to",
+    )
+    parser.add_argument(
+        "--fake-latency",
+        type=float,
+        default=1.0,
+        help="Average artificial latency in seconds of the fake backend",
+    )
+    parser.add_argument(
+        "--fake-responses",
+        default="./jsons",
+        help="Directory with mp_XXX.json files served as canned responses by the fake backend",
+    )
+    parser.add_argument(
+        "--fake-error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of fake backend calls that fail with a retryable rate limit error",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=None,
+        help="Requests per minute allowed by the backend (default depends on the backend)",
+    )
+    parser.add_argument(
+        "--tpm",
+        type=float,
+        default=None,
+        help="Input tokens per minute allowed by the backend (default depends on the backend)",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=5,
+        help="Number of retries with exponential backoff for retryable API errors",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-extract MPs even if their JSON already exists (cached results are still reused)",
+    )
+    parser.add_argument(
+        "--jsonl",
+        nargs="?",
+        const="mp_data.jsonl",
+        default=None,
+        metavar="PATH",
+        help="Append each result to a JSON Lines file as soon as it completes instead of writing mp_data.json at the end (default path: mp_data.jsonl)",
+    )
+    parser.add_argument(
+        "--changed-only",
+        action="store_true",
+        help="Only extract the MPs whose sub-PDF split.py rewrote after their JSON was written",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default="./cache",
+        help="Directory of the extraction cache keyed by PDF content, prompt and model",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=500,
+        help="Maximum size of the extraction cache in MB; least recently used entries are evicted",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always call the backend instead of reusing cached results",
+    )
+    parser.add_argument(
+        "--upload-concurrency",
+        type=int,
+        default=4,
+        help="Number of PDF uploads running ahead of the generate calls (Gemini and fake backends)",
+    )
+    parser.add_argument(
+        "--upload-registry",
+        default="./gemini_uploads.json",
+        help="File mapping PDF content hashes to uploaded Gemini files, so live uploads are reused",
+    )
+    parser.add_argument(
+        "--text-mode",
+        action="store_true",
+        help="Send the PDF's text layer instead of the PDF; only pages without text are sent as PDF",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Pack up to N small declarations into one request (default: 1, no batching)",
+    )
+    parser.add_argument(
+        "--batch-tokens",
+        type=int,
+        default=10000,
+        help="Estimated input token budget of the declarations packed into one batch request",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream responses and stop reading as soon as the JSON is complete",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="Write per-stage timings, token counts, retries and cache hits to PATH",
+    )
+    parser.add_argument(
+        "--metrics-format",
+        choices=["jsonl", "prometheus"],
+        default="jsonl",
+        help="jsonl appends one event per timed stage as it happens; prometheus writes a text exposition at the end (default: jsonl)",
+    )
+    parser.add_argument(
+        "--shard-pages",
+        type=int,
+        default=0,
+        help="Extract declarations longer than N pages in parts of about N pages (sections, and property lists cut between properties), one concurrent request per part (default: 0, off)",
+    )
+    parser.add_argument(
+        "--queue",
+        nargs="?",
+        const=DEFAULT_QUEUE,
+        default=None,
+        metavar="PATH",
+        help=f"Claim MPs from a SQLite job queue shared with other worker processes or machines, instead of skipping the MPs whose JSON exists (default path: {DEFAULT_QUEUE})",
+    )
+    parser.add_argument(
+        "--worker-id",
+        default=None,
+        help="Name of this worker in the job queue (default: hostname:pid)",
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=600,
+        help="How long a claimed job stays leased without a heartbeat before another worker reclaims it (default: 600)",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="Attempts per job in the job queue before it is marked failed (default: 3)",
+    )
+    parser.add_argument(
+        "--fake-seed",
+        type=int,
+        default=None,
+        help="Seed of the fake backend's latency and error injection, for reproducible runs",
+    )
+    return parser
 
-    # Configure Gemini API
-    genai.configure(api_key=api_key)
-    # Initialize the Gemini model
-    model = genai.GenerativeModel("gemini-2.0-flash")
 
-elif use_openai:
-    # Check for OpenAI API key if we're using OpenAI
+# Settings of the current run. setup() fills them from the command line; until then they hold
+# the defaults, so the module can be imported without parsing sys.argv or needing API keys
+args = build_arg_parser().parse_args([])
+
+# Model names and generation settings; they are part of the cache key
+GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_GENERATION_CONFIG = {
+    "max_output_tokens": 20000,  # Set maximum output tokens to 20,000
+}
+OPENAI_MODEL = "o1-mini"
+OPENAI_MAX_TOKENS = 4000
+
+# Default (requests/min, input tokens/min) quotas per backend; None means unlimited
+BACKEND_RATE_LIMITS = {
+    "gemini": (2000, 4_000_000),
+    "openai": (500, 200_000),
+    "fake": (None, None),
+}
+
+# HTTP status codes worth retrying: timeouts, rate limits and transient server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Exception class names of the Gemini (google.api_core) and OpenAI clients that are retryable
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ServiceUnavailable",
+    "InternalServerError",
+    "DeadlineExceeded",
+    "RateLimitError",
+    "APITimeoutError",
+    "APIConnectionError",
+}
+
+
+class RateLimiter:
+    # Client-side token buckets for requests/min and tokens/min, shared by all worker threads
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        if requests_per_minute:
+            self.buckets["requests"] = self._new_bucket(requests_per_minute)
+        if tokens_per_minute:
+            self.buckets["tokens"] = self._new_bucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self.last_refill = time.monotonic()
+
+    @staticmethod
+    def _new_bucket(per_minute):
+        # Start full so the first burst is not delayed
+        return {"capacity": per_minute, "available": per_minute, "rate": per_minute / 60.0}
+
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        for bucket in self.buckets.values():
+            bucket["available"] = min(
+                bucket["capacity"], bucket["available"] + elapsed * bucket["rate"]
+            )
+
+    def acquire(self, tokens=0):
+        # Block until one request and `tokens` input tokens fit in the buckets
+        needed = {"requests": 1, "tokens": tokens}
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                for name, bucket in self.buckets.items():
+                    # A request larger than the whole bucket waits for a full bucket
+                    amount = min(needed[name], bucket["capacity"])
+                    if bucket["available"] < amount:
+                        wait = max(wait, (amount - bucket["available"]) / bucket["rate"])
+                if wait <= 0:
+                    for name, bucket in self.buckets.items():
+                        bucket["available"] -= min(needed[name], bucket["capacity"])
+                    return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # Stop every thread from sending requests for a while after the server pushed back
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def is_retryable_error(error):
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int) and status in RETRYABLE_STATUS_CODES:
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def call_with_retries(function, max_retries=None, base_delay=2.0, max_delay=60.0):
+    # Call function(), retrying retryable errors with jittered exponential backoff
+    max_retries = args.max_retries if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        try:
+            return function()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable_error(e):
+                raise
+            # Full jitter keeps the worker threads from retrying in lockstep
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            print(f"⚠️ Retryable error ({type(e).__name__}: {e}), retrying in {delay:.1f}s")
+            metrics.count("retries")
+            rate_limiter.pause(delay)
+            time.sleep(delay)
+
+
+# Rough token costs: ~258 tokens per PDF page sent as PDF, ~450 per page sent as text
+PDF_TOKENS_PER_PAGE = 258
+TEXT_TOKENS_PER_PAGE = 450
+
+
+def count_pages(pdf_path):
     try:
-        import openai
-    except ImportError:
-        print("Error: OpenAI Python package not installed")
-        print("Please install it with: pip install openai")
-        sys.exit(1)
+        from PyPDF2 import PdfReader
+
+        return len(PdfReader(pdf_path).pages)
+    except Exception:
+        return max(1, os.path.getsize(pdf_path) // 50_000)
+
+
+def estimate_request_tokens(pdf_path):
+    # Rough input size: ~4 characters per prompt token plus the PDF pages
+    return len(get_extraction_prompt()) // 4 + PDF_TOKENS_PER_PAGE * count_pages(pdf_path)
+
+
+def estimate_declaration_tokens(pdf_path):
+    # Input tokens of a declaration without the prompt, used to pack batches
+    tokens_per_page = TEXT_TOKENS_PER_PAGE if args.text_mode else PDF_TOKENS_PER_PAGE
+    return tokens_per_page * count_pages(pdf_path)
+
+
+def estimate_text_request_tokens(request_text, scanned_page_count):
+    # Same estimate for --text-mode requests: text tokens plus the pages attached as PDF
+    return len(request_text) // 4 + PDF_TOKENS_PER_PAGE * scanned_page_count
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        print("Error: OPENAI_API_KEY not found in .env file")
-        print("Please add it to your .env file as: OPENAI_API_KEY=your_api_key_here")
-        sys.exit(1)
 
-    # Configure OpenAI client
-    openai_client = openai.OpenAI(api_key=api_key)
+def record_tokens(event, response_text, prompt_tokens=None, output_tokens=None):
+    # Token counts of an LLM call: as reported by the API if it does, otherwise the input
+    # estimate and ~4 characters per output token
+    event["tokens_in"] = prompt_tokens or event["tokens_in"]
+    event["tokens_out"] = output_tokens or len(response_text) // 4
+    metrics.count("tokens_in", event["tokens_in"])
+    metrics.count("tokens_out", event["tokens_out"])
+
+
+# The extraction cache is set up in setup() unless --no-cache is given
+extraction_cache = None
+extraction_key_fingerprint = None
+
+# The upload registry is set up in setup() for the backends that upload files
+upload_registry = None
+
+# Content hash of every sub-PDF by source_file, from split.py's manifest; None without one
+split_hashes = None
+
+# Content hash of the sub-PDF each JSON in the output directory was extracted from
+EXTRACT_MANIFEST_NAME = ".extract_manifest.json"
+extract_manifest_lock = threading.Lock()
+
+# The extraction backend and its client-side rate limiter are set up by setup(); unlimited until then
+backend = None
+rate_limiter = RateLimiter()
+
+# At most --concurrency requests are in flight: whole and batch requests and the parts of sharded
+# declarations each take a slot. The parts run in one shared pool, not in a pool per MP.
+request_slots = threading.BoundedSemaphore(1)
+section_executor = None
 
 
 # Define the common prompt to be used by both APIs
@@ -250,13 +564,7 @@ def get_extraction_prompt():
     }
 
 
-    The marke / make of the car should be the full name of the brand, not just an abbreviation, e.g. VW should be Volkswagen.
-    Any currency balance should be extracted as a number with no decimals.
-    Fraction should be extracted as a decimal number up to 2 decimal places.
-    Currencies should be extracted as ISO 4217 currency codes, e.g. EUR for Euro, HUF for Hungarian Forint.
-    Any form of Orszaggyulesi Kepviselo (national parliament member) should be extracted as "Országgyűlési képviselő".
     When finances / loans of co-debtors are mentioned, include them as if they were part of the declarant's own finances.
-    When no currency is mentioned, assume HUF.
     When possible, turn all caps place and person names to standard capitalization, e.g. "VESZPRÉM" -> "Veszprém".
 
     In the Jövedelemnyilatkozat and Gazdasági Érdekeltségi Nyilatkozat sections the following rules apply:
@@ -273,119 +581,1046 @@ def get_extraction_prompt():
     """
 
 
-# Extract data using Google's Gemini API
-def extract_mp_data_with_gemini(pdf_path):
-    # Upload the PDF file directly to Gemini
-    file = genai.upload_file(pdf_path)
-    prompt = get_extraction_prompt()
+# Build the --text-mode request text: the prompt followed by the declaration's text layer
+def get_text_mode_request(declaration_text, has_attachment, prompt=None):
+    attachment_note = (
+        " Pages without a text layer are attached as a PDF." if has_attachment else ""
+    )
+    return f"""{prompt or get_extraction_prompt()}
+    The declaration is given below as text extracted from the PDF, page by page, with tables in Markdown format.{attachment_note}
 
-    # Get response from Gemini by sending both the file and prompt
-    try:
-        generation_config = {
-            "max_output_tokens": 20000,  # Set maximum output tokens to 10,000
+{declaration_text}
+"""
+
+
+# Name of the per-MP JSON a PDF's result is written to, e.g. mp_001
+def get_source_file(pdf_path):
+    return Path(pdf_path).stem
+
+
+# Build the prompt of a batch request holding several declarations
+def get_batch_prompt(source_files):
+    return f"""{get_extraction_prompt()}
+    This request contains {len(source_files)} separate declarations: {", ".join(source_files)}.
+    Each declaration is preceded by a line of the form "source_file: mp_XXX".
+    Instead of a single JSON object, return a JSON array with exactly one object per declaration.
+    Each object follows the schema above and has an additional "source_file" field set to the declaration's source_file value.
+    """
+
+
+# Build the prompt of a request for one part of a long declaration (see --shard-pages)
+def get_section_prompt(fields):
+    return f"""{get_extraction_prompt()}
+    The attached pages are only one part of the declaration. Extract only these fields of the schema: {", ".join(fields)}.
+    Return a JSON object with the same nesting as the schema that contains only these fields and data_not_extracted_explanation.
+    """
+
+
+# Yield the parts of a batch request: ("text", str) for text, ("pdf", path) for a declaration
+# PDF and ("pdf_bytes", bytes) for the pages without a text layer in --text-mode
+def get_batch_parts(pdf_paths):
+    for pdf_path in pdf_paths:
+        yield "text", f"source_file: {get_source_file(pdf_path)}"
+        if args.text_mode:
+            declaration_text, scanned_pdf, _ = extract_declaration_text(pdf_path)
+            yield "text", declaration_text
+            if scanned_pdf is not None:
+                yield "pdf_bytes", scanned_pdf
+        else:
+            yield "pdf", pdf_path
+
+
+# Split a batch response back into per-MP results; returns None if it is not a batch response.
+# MPs missing from the response, or whose record was cut off at the output token limit, are
+# left out, so they are extracted again with a request of their own.
+def demultiplex_batch_response(data, pdf_paths):
+    if not isinstance(data, list):
+        return None
+    by_source_file = {}
+    for item in data:
+        if isinstance(item, dict) and isinstance(item.get("source_file"), str):
+            by_source_file[item.pop("source_file")] = item
+    results = {}
+    for pdf_path in pdf_paths:
+        item = by_source_file.get(get_source_file(pdf_path))
+        if item is None or is_truncated(item):
+            continue
+        results[pdf_path] = item
+    return results
+
+
+def estimate_batch_tokens(pdf_paths):
+    return len(get_extraction_prompt()) // 4 + sum(
+        estimate_declaration_tokens(pdf_path) for pdf_path in pdf_paths
+    )
+
+
+# Text of a streamed Gemini response, skipping chunks without text (e.g. the final one)
+def iter_gemini_text(response):
+    for chunk in response:
+        try:
+            yield chunk.text
+        except ValueError:
+            continue
+
+
+# Every backend has the same interface:
+#   name                      key of BACKEND_RATE_LIMITS and of the cache fingerprint
+#   upload_api                object with upload_file()/get_file() for UploadRegistry, or None
+#   model_config()            (model name, generation settings) that determine the answer
+#   extract(pdf_path)         parsed result of one declaration
+#   extract_section(pdf_path, section_pdf, fields)
+#                             parsed result of the given schema fields from one part of a
+#                             declaration, written to section_pdf (see --shard-pages)
+#   extract_batch(pdf_paths)  {pdf_path: result} of several declarations, or None if the
+#                             response did not match the batch
+class GeminiBackend:
+    name = "gemini"
+    description = "detailed extraction using Gemini"
+
+    def __init__(self):
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise RuntimeError(
+                "GOOGLE_API_KEY not found in .env file\n"
+                "Please add it to your .env file as: GOOGLE_API_KEY=your_api_key_here"
+            )
+        # Configure Gemini API
+        genai.configure(api_key=api_key)
+        # Initialize the Gemini model
+        self.model = genai.GenerativeModel(GEMINI_MODEL)
+        self.upload_api = genai
+
+    def model_config(self):
+        return GEMINI_MODEL, dict(GEMINI_GENERATION_CONFIG)
+
+    def extract(self, pdf_path, prompt=None):
+        if args.text_mode:
+            # Send the text layer, attaching only the pages without text as inline PDF data
+            declaration_text, scanned_pdf, scanned_page_count = extract_declaration_text(pdf_path)
+            request_text = get_text_mode_request(declaration_text, scanned_pdf is not None, prompt)
+            contents = [request_text]
+            if scanned_pdf is not None:
+                contents.insert(0, {"mime_type": "application/pdf", "data": scanned_pdf})
+            estimated_tokens = estimate_text_request_tokens(request_text, scanned_page_count)
+        else:
+            # Get the uploaded PDF from the registry (reused or prefetched in the background)
+            file = upload_registry.get(pdf_path)
+            contents = [file, prompt or get_extraction_prompt()]
+            estimated_tokens = estimate_request_tokens(pdf_path)
+
+        # Get response from Gemini by sending both the file and prompt
+        return self.generate(contents, estimated_tokens)
+
+    def extract_section(self, pdf_path, section_pdf, fields):
+        return self.extract(section_pdf, get_section_prompt(fields))
+
+    def extract_batch(self, pdf_paths):
+        contents = [get_batch_prompt([get_source_file(p) for p in pdf_paths])]
+        for kind, value in get_batch_parts(pdf_paths):
+            if kind == "pdf":
+                contents.append(upload_registry.get(value))
+            elif kind == "pdf_bytes":
+                contents.append({"mime_type": "application/pdf", "data": value})
+            else:
+                contents.append(value)
+        data = self.generate(contents, estimate_batch_tokens(pdf_paths))
+        return demultiplex_batch_response(data, pdf_paths)
+
+    # Send a Gemini request and parse the answer, reading it as a stream with --stream
+    def generate(self, contents, estimated_tokens):
+        def generate():
+            rate_limiter.acquire(estimated_tokens)
+            parser = None
+            with metrics.timer("llm", tokens_in=estimated_tokens) as event:
+                if args.stream:
+                    response = self.model.generate_content(
+                        contents, generation_config=GEMINI_GENERATION_CONFIG, stream=True
+                    )
+                    parser = parse_json_stream(iter_gemini_text(response))
+                    response_text = parser.text()
+                else:
+                    response = self.model.generate_content(
+                        contents, generation_config=GEMINI_GENERATION_CONFIG
+                    )
+                    response_text = response.text
+                usage = getattr(response, "usage_metadata", None)
+                record_tokens(
+                    event,
+                    response_text,
+                    getattr(usage, "prompt_token_count", None),
+                    getattr(usage, "candidates_token_count", None),
+                )
+            with metrics.timer("parse"):
+                return parse_llm_response(response_text, parser)
+
+        return call_with_retries(generate)
+
+
+class OpenAIBackend:
+    name = "openai"
+    description = "detailed extraction using OpenAI"
+    # PDFs are sent inline
+    upload_api = None
+
+    def __init__(self):
+        try:
+            import openai
+        except ImportError:
+            raise RuntimeError(
+                "OpenAI Python package not installed\nPlease install it with: pip install openai"
+            )
+
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError(
+                "OPENAI_API_KEY not found in .env file\n"
+                "Please add it to your .env file as: OPENAI_API_KEY=your_api_key_here"
+            )
+
+        # Configure OpenAI client
+        self.client = openai.OpenAI(api_key=api_key)
+
+    def model_config(self):
+        return OPENAI_MODEL, {"max_tokens": OPENAI_MAX_TOKENS}
+
+    @staticmethod
+    def pdf_content(pdf_bytes):
+        # Encode the PDF as base64 for OpenAI
+        base64_pdf = base64.b64encode(pdf_bytes).decode("utf-8")
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:application/pdf;base64,{base64_pdf}",
+                "detail": "high",
+            },
         }
-        response = model.generate_content(
-            [file, prompt], generation_config=generation_config
+
+    def extract(self, pdf_path, prompt=None):
+        if args.text_mode:
+            # Send the text layer; only pages without text are attached as PDF
+            declaration_text, pdf_bytes, scanned_page_count = extract_declaration_text(pdf_path)
+            prompt = get_text_mode_request(declaration_text, pdf_bytes is not None, prompt)
+            estimated_tokens = estimate_text_request_tokens(prompt, scanned_page_count)
+        else:
+            # Read the PDF file as bytes for OpenAI
+            with open(pdf_path, "rb") as file:
+                pdf_bytes = file.read()
+            prompt = prompt or get_extraction_prompt()
+            estimated_tokens = estimate_request_tokens(pdf_path)
+
+        content = [{"type": "text", "text": prompt}]
+        if pdf_bytes is not None:
+            content.append(self.pdf_content(pdf_bytes))
+
+        return self.generate(content, estimated_tokens)
+
+    def extract_section(self, pdf_path, section_pdf, fields):
+        return self.extract(section_pdf, get_section_prompt(fields))
+
+    def extract_batch(self, pdf_paths):
+        content = [{"type": "text", "text": get_batch_prompt([get_source_file(p) for p in pdf_paths])}]
+        for kind, value in get_batch_parts(pdf_paths):
+            if kind == "text":
+                content.append({"type": "text", "text": value})
+                continue
+            if kind == "pdf":
+                with open(value, "rb") as file:
+                    value = file.read()
+            content.append(self.pdf_content(value))
+        data = self.generate(content, estimate_batch_tokens(pdf_paths))
+        return demultiplex_batch_response(data, pdf_paths)
+
+    # Send an OpenAI request and parse the answer, reading it as a stream with --stream
+    def generate(self, content, estimated_tokens):
+        def generate():
+            rate_limiter.acquire(estimated_tokens)
+            parser = None
+            usage = None
+            with metrics.timer("llm", tokens_in=estimated_tokens) as event:
+                # Create a message with the PDF attachment
+                response = self.client.chat.completions.create(
+                    model=OPENAI_MODEL,  # Using Vision model to process PDF
+                    messages=[{"role": "user", "content": content}],
+                    max_tokens=OPENAI_MAX_TOKENS,
+                    stream=args.stream,
+                )
+                if args.stream:
+                    try:
+                        parser = parse_json_stream(
+                            chunk.choices[0].delta.content or ""
+                            for chunk in response
+                            if chunk.choices
+                        )
+                    finally:
+                        # Stop the download if the JSON was complete before the stream ended
+                        response.close()
+                    result_text = parser.text()
+                else:
+                    # Extract the response text
+                    result_text = response.choices[0].message.content
+                    usage = response.usage
+                record_tokens(
+                    event,
+                    result_text,
+                    getattr(usage, "prompt_tokens", None),
+                    getattr(usage, "completion_tokens", None),
+                )
+            with metrics.timer("parse"):
+                return parse_llm_response(result_text, parser)
+
+        return call_with_retries(generate)
+
+
+class FakeRateLimitError(Exception):
+    # Mimics an HTTP 429 from a real provider
+    status_code = 429
+
+
+# Simulated response of the fake backend, in chunks spread over the latency when streaming
+def iter_fake_response(response_text, latency, chunk_size=256):
+    chunks = [
+        response_text[i : i + chunk_size] for i in range(0, len(response_text), chunk_size)
+    ]
+    for chunk in chunks:
+        time.sleep(latency / len(chunks))
+        yield chunk
+
+
+class FakeBackend:
+    # Local replay backend for offline testing: answers with the previously extracted JSON of
+    # each MP from responses_dir, after an artificial latency and with injected retryable errors.
+    # With a seed, the latency and errors of each request attempt are reproducible across runs.
+    name = "fake"
+    description = "the fake backend"
+
+    def __init__(self, responses_dir="./jsons", latency=1.0, error_rate=0.0, seed=None):
+        self.responses_dir = responses_dir
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        # Attempts so far per request, kept across generate calls so a request retried by the
+        # queue or a later pass draws new latencies and errors instead of repeating its failure
+        self.attempts = {}
+        self.attempts_lock = threading.Lock()
+        # Uploads are faster than generate calls
+        self.upload_api = MockUploadAPI(latency / 2)
+
+    def model_config(self):
+        return "fake", {"responses": os.path.abspath(self.responses_dir)}
+
+    def canned_response(self, pdf_path):
+        # Use the previously extracted JSON as the response if there is one
+        canned_path = os.path.join(self.responses_dir, f"{get_source_file(pdf_path)}.json")
+        if os.path.exists(canned_path):
+            with open(canned_path, "r", encoding="utf-8") as f:
+                return f.read()
+        mp_num = int(pdf_path.split("_")[1].split(".")[0])
+        return json.dumps(
+            {"nyilatkozattevo_nev": f"Fake MP {mp_num}", "data_not_extracted_explanation": None}
         )
-        return parse_llm_response(response.text)
-    except Exception as e:
-        print(f"Error calling Gemini API: {e}")
+
+    def request_tokens(self, pdf_path, prompt=None):
+        if args.text_mode:
+            # Build the text request like the real backends do
+            declaration_text, scanned_pdf, scanned_page_count = extract_declaration_text(pdf_path)
+            request_text = get_text_mode_request(declaration_text, scanned_pdf is not None, prompt)
+            return estimate_text_request_tokens(request_text, scanned_page_count)
+        # Go through the mock upload API like the Gemini backend does
+        upload_registry.get(pdf_path)
+        return estimate_request_tokens(pdf_path)
+
+    def extract(self, pdf_path):
+        estimated_tokens = self.request_tokens(pdf_path)
+        return self.generate(self.canned_response(pdf_path), estimated_tokens, get_source_file(pdf_path))
+
+    def extract_section(self, pdf_path, section_pdf, fields):
+        # Answers with the given fields of the canned response of the whole declaration
+        estimated_tokens = self.request_tokens(section_pdf, get_section_prompt(fields))
+        canned = json.loads(self.canned_response(pdf_path))
+        # The whole canned list goes to the first part of a list; continuation parts
+        # (ingatlanok_2, ...) answer with an empty one
+        continuation = re.search(r"_\d+$", Path(section_pdf).stem) is not None
+        part = {}
+        for field in fields:
+            value = get_field(canned, field)
+            if continuation and isinstance(value, list):
+                value = []
+            if value is not None:
+                set_field(part, field, value)
+        if "nyilatkozattevo_nev" in fields:
+            part["data_not_extracted_explanation"] = canned.get("data_not_extracted_explanation")
+        response_text = json.dumps(part, ensure_ascii=False)
+        return self.generate(response_text, estimated_tokens, get_source_file(section_pdf))
+
+    def extract_batch(self, pdf_paths):
+        # Answers with an array of the canned responses
+        items = []
+        for pdf_path in pdf_paths:
+            item = json.loads(self.canned_response(pdf_path))
+            item["source_file"] = get_source_file(pdf_path)
+            items.append(item)
+        response_text = json.dumps(items, ensure_ascii=False)
+        request_id = ",".join(get_source_file(pdf_path) for pdf_path in pdf_paths)
+        data = self.generate(response_text, estimate_batch_tokens(pdf_paths), request_id)
+        return demultiplex_batch_response(data, pdf_paths)
+
+    # "Send" a fake request with artificial latency and error injection, then parse the answer
+    def generate(self, response_text, estimated_tokens, request_id):
+        def generate():
+            with self.attempts_lock:
+                attempts = self.attempts.get(request_id, 0) + 1
+                self.attempts[request_id] = attempts
+            rng = random if self.seed is None else random.Random(f"{self.seed}:{request_id}:{attempts}")
+            rate_limiter.acquire(estimated_tokens)
+            parser = None
+            with metrics.timer("llm", tokens_in=estimated_tokens) as event:
+                if rng.random() < self.error_rate:
+                    raise FakeRateLimitError("Fake backend: rate limit exceeded")
+                # Simulate a network round-trip of varying length
+                latency = rng.uniform(0.5, 1.5) * self.latency
+                if args.stream:
+                    parser = parse_json_stream(iter_fake_response(response_text, latency))
+                else:
+                    time.sleep(latency)
+                record_tokens(event, parser.text() if parser else response_text)
+            with metrics.timer("parse"):
+                return parse_llm_response(parser.text() if parser else response_text, parser)
+
+        return call_with_retries(generate)
+
+
+def create_backend(options):
+    # Gemini unless another backend is specifically requested
+    if options.openai:
+        return OpenAIBackend()
+    if options.fake:
+        return FakeBackend(
+            options.fake_responses, options.fake_latency, options.fake_error_rate, options.fake_seed
+        )
+    return GeminiBackend()
+
+
+# Greedily pack consecutive small declarations into batches within the size and token budget
+def pack_batches(pdf_paths):
+    batches = []
+    current = []
+    current_tokens = 0
+    for pdf_path in pdf_paths:
+        tokens = estimate_declaration_tokens(pdf_path)
+        if current and (
+            len(current) >= args.batch_size or current_tokens + tokens > args.batch_tokens
+        ):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(pdf_path)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+# Value of a dotted schema field such as "vagyonyi_nyilatkozat.ingatlanok", or None
+def get_field(data, field):
+    for key in field.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def set_field(data, field, value):
+    *parents, last = field.split(".")
+    for key in parents:
+        data = data.setdefault(key, {})
+    data[last] = value
+
+
+# Parts of the declarations to extract in sections with --shard-pages: {pdf_path: [(name, fields, section_pdf)]}
+section_plans = {}
+
+
+# The parts a declaration is extracted in, or None if it is extracted with a single request
+def plan_sections(pdf_path):
+    if args.shard_pages <= 0 or count_pages(pdf_path) <= args.shard_pages:
+        return None
+    if pdf_path not in section_plans:
+        sections = find_sections(pdf_path, args.shard_pages)
+        section_plans[pdf_path] = (
+            write_section_pdfs(pdf_path, sections, os.path.join(args.cache_dir, "sections"))
+            if len(sections) > 1
+            else None
+        )
+    return section_plans[pdf_path]
+
+
+# Combine the results of the parts into one record; list fields split over several parts are concatenated
+def merge_sections(plan, results):
+    merged = {}
+    explanations = []
+    for (name, fields, _), data in zip(plan, results):
+        # An unparseable part makes the whole result unparseable, so it is not cached
+        if not isinstance(data, dict) or "declarant" in data:
+            return data
+        for field in fields:
+            value = get_field(data, field)
+            previous = get_field(merged, field)
+            if isinstance(previous, list) and isinstance(value, list):
+                previous.extend(value)
+            elif previous is None:
+                set_field(merged, field, value)
+        explanation = data.get("data_not_extracted_explanation")
+        if explanation:
+            explanations.append(explanation)
+    merged["data_not_extracted_explanation"] = " ".join(explanations) or None
+    return merged
+
+
+# Extract a declaration, in concurrent requests per part if it is long enough to be sharded
+def extract_in_sections(pdf_path):
+    plan = plan_sections(pdf_path)
+    if plan is None:
+        with request_slots:
+            return backend.extract(pdf_path)
+
+    source_file = get_source_file(pdf_path)
+    print(f"✂️ Extracting {source_file} in {len(plan)} parts: {', '.join(name for name, _, _ in plan)}")
+
+    def extract_section(name, fields, section_pdf):
+        # Metric labels are per thread, so the part's thread sets them again
+        with request_slots, metrics.labels(mp=source_file, section=name):
+            return backend.extract_section(pdf_path, section_pdf, fields)
+
+    try:
+        # This worker holds no slot while it waits, so the parts can take them
+        futures = [section_executor.submit(extract_section, *part) for part in plan]
+        # Every part finishes before its PDF is deleted, even if another part failed
+        wait(futures)
+        results = [future.result() for future in futures]
+    finally:
+        # The part PDFs are only needed for this extraction; a retry writes them again
+        section_plans.pop(pdf_path, None)
+        for _, _, section_pdf in plan:
+            if os.path.exists(section_pdf):
+                os.remove(section_pdf)
+    return merge_sections(plan, results)
+
+
+# Helper function to parse and clean up LLM responses
+# Added to data_not_extracted_explanation of a record repaired from a truncated response
+TRUNCATION_NOTE = "Response was truncated at the output token limit; the JSON was repaired and may be incomplete."
+
+
+def parse_llm_response(response_text, parser=None):
+    if parser is None:
+        try:
+            # First try to parse the whole response as JSON
+            data = json.loads(response_text)
+            return data
+        except (json.JSONDecodeError, RecursionError):
+            pass
+
+        # Find the first JSON object or array in a single linear scan. This skips ```json
+        # fences and surrounding text, and repairs JSON cut off at the output token limit.
+        parser = IncrementalJSONParser()
+        parser.feed(response_text)
+
+    data, truncated = parser.result()
+    if data is not None:
+        if truncated:
+            print("⚠️ Response was truncated; repaired the JSON up to the last complete value")
+            # In a list (a batch response) the cut is in or after its last item
+            items = [data] if isinstance(data, dict) else [item for item in data if isinstance(item, dict)][-1:]
+            for item in items:
+                explanation = item.get("data_not_extracted_explanation")
+                item["data_not_extracted_explanation"] = f"{explanation} {TRUNCATION_NOTE}" if explanation else TRUNCATION_NOTE
+        return data
+
+    # Try to extract the name at minimum
+    name_match = re.search(r"\"name\":\s*\"([^\"]+)\"", response_text)
+    if name_match:
+        name = name_match.group(1)
         return {
-            "declarant": {"name": "API Error"},
-            "data_not_extracted_explanation": f"Error during API call: {str(e)}",
+            "declarant": {"name": name},
+            "data_not_extracted_explanation": "Extracted name only; JSON parsing failed.",
         }
 
+    print(f"Failed to parse response as JSON: {response_text}")
 
-# Extract data using OpenAI's API
-def extract_mp_data_with_openai(pdf_path):
-    # Read the PDF file as bytes for OpenAI
-    with open(pdf_path, "rb") as file:
-        pdf_bytes = file.read()
-        # Encode the PDF as base64 for OpenAI
-        base64_pdf = base64.b64encode(pdf_bytes).decode("utf-8")
+    # If all fails, return a default error response
+    return {
+        "declarant": {"name": "Error parsing response"},
+        "data_not_extracted_explanation": f"Failed to parse response as JSON. Response starts with: {response_text[:200]}...",
+    }
 
-    prompt = get_extraction_prompt()
 
-    try:
-        # Create a message with the PDF attachment
-        response = openai_client.chat.completions.create(
-            model="o1-mini",  # Using Vision model to process PDF
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:application/pdf;base64,{base64_pdf}",
-                                "detail": "high",
-                            },
-                        },
-                    ],
-                }
-            ],
-            max_tokens=4000,
+# Fingerprint of the prompt, model and generation settings of the chosen backend
+def backend_fingerprint():
+    model_name, config = backend.model_config()
+    # Text mode sends different input, so it gets its own cache entries
+    if args.text_mode:
+        config["input"] = "text"
+    return extraction_fingerprint(get_extraction_prompt(), model_name, config)
+
+
+def is_truncated(data):
+    return TRUNCATION_NOTE in (data.get("data_not_extracted_explanation") or "")
+
+
+# Serve results from the content-addressed cache, calling the backend only on a miss
+def extract_with_cache(pdf_path, extract_function):
+    if extraction_cache is None:
+        return extract_function(pdf_path)
+
+    key = extraction_cache.key(pdf_path, extraction_key_fingerprint)
+    data = extraction_cache.get(key)
+    if data is not None:
+        print(f"♻️ Cache hit for {pdf_path}")
+        metrics.count("cache_hits")
+        return data
+    metrics.count("cache_misses")
+
+    data = extract_function(pdf_path)
+    # Don't cache responses that could not be parsed or were cut off, so they are retried next time
+    if isinstance(data, dict) and "declarant" not in data and not is_truncated(data):
+        extraction_cache.put(key, data)
+    return data
+
+
+class ResponseParseError(Exception):
+    # The model's answer held no JSON that could be parsed (see parse_llm_response)
+    pass
+
+
+# Record a failed MP in a subdirectory so the "already processed" check does not count it as done
+def save_mp_error(pdf_path, error):
+    mp_num = int(pdf_path.split("_")[1].split(".")[0])
+    error_path = os.path.join(args.output_dir, "errors", f"mp_{mp_num:03d}.json")
+    print(f"❌ Error extracting MP {mp_num}: {error}")
+    os.makedirs(os.path.dirname(error_path), exist_ok=True)
+    with open(error_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"pdf_path": pdf_path, "error_type": type(error).__name__, "error": str(error)},
+            f,
+            indent=2,
+            ensure_ascii=False,
         )
+    print(f"💾 Saved error details to {error_path}")
+
+
+# Save an MP's extracted data to its JSON file
+def save_mp_data(pdf_path, data):
+    mp_num = int(pdf_path.split("_")[1].split(".")[0])
+    json_path = os.path.join(args.output_dir, f"mp_{mp_num:03d}.json")
+    error_path = os.path.join(args.output_dir, "errors", f"mp_{mp_num:03d}.json")
+
+    # Brand names, currency codes, fractions, amounts and capitalization (see normalize.py)
+    if isinstance(data, dict):
+        normalize_declaration(data)
+
+    # Extract and print name if available
+    name = None
+    # Check original schema
+    if data and isinstance(data, dict):
+        if "declarant" in data and "name" in data["declarant"]:
+            name = data["declarant"]["name"]
+        # Check new schema
+        elif "nyilatkozattevo_nev" in data:
+            name = data["nyilatkozattevo_nev"]
+
+    if name:
+        print(f"✅ Extraction successful for MP {mp_num}: {name}")
+    else:
+        print(f"❌ Could not extract name from the data of MP {mp_num}")
 
-        # Extract the response text
-        result_text = response.choices[0].message.content
-        return parse_llm_response(result_text)
+    # Save individual MP data to a JSON file
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    print(f"💾 Saved MP data to {json_path}")
+    record_extracted_hash(pdf_path)
+
+    # Clear the error left by an earlier failed run
+    if os.path.exists(error_path):
+        os.remove(error_path)
+
+
+# Extract a single MP PDF and save its JSON file
+def process_mp_pdf(pdf_path, extract_function):
+    mp_num = int(pdf_path.split("_")[1].split(".")[0])
+
+    # Extract structured MP data
+    print(f"⌛ Extracting data from MP {mp_num} PDF ({pdf_path})...")
+    try:
+        with metrics.labels(mp=get_source_file(pdf_path)), metrics.timer("mp"):
+            data = extract_with_cache(pdf_path, extract_function)
+        # The stub of an unparseable response is an error, not a result, so no JSON is written
+        # for it and the next run retries the MP
+        if isinstance(data, dict) and "declarant" in data:
+            raise ResponseParseError(data.get("data_not_extracted_explanation") or "Response could not be parsed")
     except Exception as e:
-        print(f"Error calling OpenAI API: {e}")
-        return {
-            "declarant": {"name": "API Error"},
-            "data_not_extracted_explanation": f"Error during API call: {str(e)}",
-        }
+        save_mp_error(pdf_path, e)
+        metrics.count("failed_mps")
+        return None
 
+    save_mp_data(pdf_path, data)
+    return data
 
-# Helper function to parse and clean up LLM responses
-def parse_llm_response(response_text):
+
+# Extract several small MP PDFs with one request, falling back to one request per MP
+def process_mp_batch(pdf_paths, extract_batch_function, extract_function):
+    if len(pdf_paths) == 1:
+        return [process_mp_pdf(pdf_paths[0], extract_function)]
+
+    source_files = ", ".join(get_source_file(pdf_path) for pdf_path in pdf_paths)
+    print(f"⌛ Extracting batch of {len(pdf_paths)} MPs ({source_files})...")
     try:
-        # First try to parse the whole response as JSON
-        data = json.loads(response_text)
-        return data
-    except json.JSONDecodeError as e:
-        # If there's a JSON parsing error, try to clean up the response text
+        batch_label = ",".join(get_source_file(pdf_path) for pdf_path in pdf_paths)
+        with metrics.labels(mp=batch_label), metrics.timer("mp", batch_size=len(pdf_paths)):
+            with request_slots:
+                batch_data = extract_batch_function(pdf_paths)
+    except Exception as e:
+        print(f"⚠️ Batch request failed ({e})")
+        batch_data = None
 
-        # Try multiple common patterns for JSON extraction
-        # 1. Try to find JSON content between triple backticks (```json ... ```)
-        json_match = re.search(r"```(?:json)?\n(.+?)\n```", response_text, re.DOTALL)
-        if json_match:
-            try:
-                data = json.loads(json_match.group(1).strip())
-                return data
-            except json.JSONDecodeError:
-                pass
-
-        # 2. Try to find JSON content with curly braces
-        json_match = re.search(r"(\{.*\})", response_text, re.DOTALL)
-        if json_match:
+    if not batch_data:
+        print(f"⚠️ Falling back to one request per MP for {source_files}")
+        return [process_mp_pdf(pdf_path, extract_function) for pdf_path in pdf_paths]
+
+    results = []
+    for pdf_path in pdf_paths:
+        if pdf_path not in batch_data:
+            print(f"⚠️ {get_source_file(pdf_path)} is missing or cut off in the batch response, extracting it alone")
+            results.append(process_mp_pdf(pdf_path, extract_function))
+            continue
+        data = batch_data[pdf_path]
+        if extraction_cache is not None:
+            extraction_cache.put(
+                extraction_cache.key(pdf_path, extraction_key_fingerprint), data
+            )
+        save_mp_data(pdf_path, data)
+        results.append(data)
+    return results
+
+
+def resume_jsonl(pdf_paths, extracted_hashes):
+    # A rerun, or a retry after a crash, continues the JSON Lines file instead of appending
+    # duplicates: MPs that already have a record are not extracted again. With --force, or when
+    # an MP's sub-PDF changed since, its old record is dropped from the file and the MP extracted
+    # again. Returns the PDFs still to extract.
+    if not os.path.exists(args.jsonl):
+        return pdf_paths
+    redo = {
+        get_source_file(pdf_path)
+        for pdf_path in pdf_paths
+        if args.force or content_changed(pdf_path, extracted_hashes)
+    }
+    records = {}
+    line_count = 0
+    rewrite = False
+    with open(args.jsonl, "r", encoding="utf-8") as f:
+        for line in f:
+            line_count += 1
             try:
-                data = json.loads(json_match.group(1).strip())
-                return data
-            except json.JSONDecodeError:
-                pass
-
-        # 3. Try to extract the name at minimum
-        name_match = re.search(r"\"name\":\s*\"([^\"]+)\"", response_text)
-        if name_match:
-            name = name_match.group(1)
-            return {
-                "declarant": {"name": name},
-                "data_not_extracted_explanation": "Extracted name only; JSON parsing failed.",
-            }
-
-        print(f"Failed to parse response as JSON: {response_text}")
-
-        # If all fails, return a default error response
-        return {
-            "declarant": {"name": "Error parsing response"},
-            "data_not_extracted_explanation": f"Failed to parse response as JSON. Response starts with: {response_text[:200]}...",
-        }
+                source_file = json.loads(line).get("source_file")
+            except (json.JSONDecodeError, AttributeError):
+                # A line cut off by a crash
+                continue
+            if source_file in redo:
+                continue
+            # Files written before records were deduplicated may hold several; the last one counts
+            records.pop(source_file, None)
+            records[source_file] = line if line.endswith("\n") else line + "\n"
+            rewrite = rewrite or not line.endswith("\n")
+    if rewrite or len(records) != line_count:
+        tmp_path = f"{args.jsonl}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(records.values())
+        os.replace(tmp_path, args.jsonl)
+        print(f"🧹 Dropped {line_count - len(records)} outdated, duplicate or incomplete records from {args.jsonl}")
+    remaining = [pdf_path for pdf_path in pdf_paths if get_source_file(pdf_path) not in records]
+    if len(remaining) < len(pdf_paths):
+        print(f"📄 {len(pdf_paths) - len(remaining)} MPs already have a record in {args.jsonl}, skipping them")
+    return remaining
+
+
+def extract_to_jsonl(batches, extract_batch_function, extract_function):
+    # Streaming mode: only a bounded window of requests is submitted at a time and every
+    # result is appended to the JSON Lines file and dropped as soon as it completes,
+    # so memory does not grow with the number of MPs and a crash loses nothing
+    max_in_flight = max(1, args.concurrency) * 2
+    success_count = failed_count = 0
+
+    def write_results(futures, output):
+        nonlocal success_count, failed_count
+        for future in futures:
+            batch = in_flight.pop(future)
+            for pdf_path, data in zip(batch, future.result()):
+                if data is None:
+                    failed_count += 1
+                    continue
+                line = json.dumps({"source_file": get_source_file(pdf_path), **data}, ensure_ascii=False)
+                output.write(line + "\n")
+                if args.print:
+                    print(line)
+                success_count += 1
+        output.flush()
+
+    in_flight = {}
+    with open(args.jsonl, "a", encoding="utf-8") as output, ThreadPoolExecutor(
+        max_workers=max(1, args.concurrency)
+    ) as executor:
+        for batch in batches:
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                write_results(done, output)
+            future = executor.submit(process_mp_batch, batch, extract_batch_function, extract_function)
+            in_flight[future] = batch
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            write_results(done, output)
+
+    if upload_registry is not None:
+        upload_registry.shutdown()
+    print(f"💾 Appended {success_count} MP declarations to {args.jsonl}")
+    if failed_count:
+        print(
+            f"⚠️ {failed_count} MPs failed, see {os.path.join(args.output_dir, 'errors')}. Run again to retry them."
+        )
+    print(
+        f"✨ Successfully processed {success_count} MPs. Run again to continue with more MPs if available."
+    )
+
+
+# Group MP PDFs into requests: long uncached declarations are sharded and started first, small
+# uncached ones are packed into batches, and the uploads of uncached PDFs are started ahead
+def plan_requests(pdf_paths):
+    # PDFs whose result is not cached yet
+    uncached_mp_pdfs = [
+        pdf_path
+        for pdf_path in pdf_paths
+        if extraction_cache is None
+        or extraction_cache.key(pdf_path, extraction_key_fingerprint) not in extraction_cache
+    ]
+
+    # Long uncached declarations are extracted in parts with --shard-pages
+    sharded_mp_pdfs = [pdf_path for pdf_path in uncached_mp_pdfs if plan_sections(pdf_path)]
+    if sharded_mp_pdfs:
+        print(f"Extracting {len(sharded_mp_pdfs)} long declarations in parts of about {args.shard_pages} pages")
+
+    # Upload the PDFs that are not cached ahead of the generate calls, so uploads overlap model latency
+    if upload_registry is not None:
+        uploads = []
+        for pdf_path in uncached_mp_pdfs:
+            plan = section_plans.get(pdf_path)
+            uploads.extend([section_pdf for _, _, section_pdf in plan] if plan else [pdf_path])
+        upload_registry.prefetch(uploads)
+
+    # Pack uncached small declarations into batch requests if requested; cached ones are served one by one
+    if args.batch_size > 1:
+        unbatched = set(sharded_mp_pdfs)
+        uncached_batches = pack_batches([pdf_path for pdf_path in uncached_mp_pdfs if pdf_path not in unbatched])
+        print(f"Packed {len(uncached_mp_pdfs) - len(unbatched)} uncached MPs into {len(uncached_batches)} requests")
+        unbatched.update(pdf_path for pdf_path in pdf_paths if pdf_path not in uncached_mp_pdfs)
+        batches = uncached_batches + [[pdf_path] for pdf_path in pdf_paths if pdf_path in unbatched]
+    else:
+        batches = [[pdf_path] for pdf_path in pdf_paths]
+
+    # Start the sharded declarations first, so the longest MPs don't finish last
+    sharded = set(sharded_mp_pdfs)
+    batches.sort(key=lambda batch: batch[0] not in sharded)
+    return batches
 
 
-def main():
+# Why an MP's result does not count as extracted, or None if it does
+def extraction_error(pdf_path, data):
+    if data is not None:
+        return None
+    error_path = os.path.join(args.output_dir, "errors", f"{get_source_file(pdf_path)}.json")
+    try:
+        with open(error_path, "r", encoding="utf-8") as f:
+            error = json.load(f)
+        return f"{error['error_type']}: {error['error']}"
+    except (OSError, ValueError, KeyError):
+        return "Extraction failed"
+
+
+# Whether an existing JSON holds a parsed declaration, not the stub of an unparseable response
+def is_extracted(json_path):
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return isinstance(data, dict) and "declarant" not in data
+
+
+def extract_from_queue(mp_pdfs, done):
+    # Queue mode: the MPs are jobs in a SQLite file, and every worker thread claims jobs until
+    # the queue is drained. Other extract.py processes on this or other machines may drain the
+    # same queue; a heartbeat renews this worker's leases so only crashed workers' jobs are reclaimed.
+    queue = JobQueue(args.queue, args.max_attempts)
+    worker = args.worker_id or default_worker_id()
+    queued = queue.sync(mp_pdfs, done, args.force)
+    counts = queue.counts()
+    print(
+        f"📋 Job queue {args.queue}: {counts['pending']} pending, {counts['running']} running, "
+        f"{counts['done']} done, {counts['failed']} failed ({queued} added or requeued)"
+    )
+    print(f"Worker {worker} extracting with {backend.description}")
+
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(args.lease_seconds / 3):
+            queue.renew(worker, args.lease_seconds)
+
+    claim_lock = threading.Lock()
+    remaining = args.limit
+
+    def claim():
+        # Claim a batch worth of jobs, at most --limit in total for this worker
+        nonlocal remaining
+        with claim_lock:
+            limit = max(1, args.batch_size)
+            if remaining is not None:
+                limit = min(limit, remaining)
+                if limit <= 0:
+                    return []
+            pdf_paths = queue.claim(worker, args.lease_seconds, limit, backend.name)
+            if remaining is not None:
+                remaining -= len(pdf_paths)
+            return pdf_paths
+
+    def work():
+        succeeded = failed = 0
+        while True:
+            pdf_paths = claim()
+            if not pdf_paths:
+                return succeeded, failed
+            for batch in plan_requests(pdf_paths):
+                for pdf_path, data in zip(batch, process_mp_batch(batch, backend.extract_batch, extract_in_sections)):
+                    error = extraction_error(pdf_path, data)
+                    queue.finish(get_source_file(pdf_path), worker, error)
+                    if error is None:
+                        succeeded += 1
+                    else:
+                        failed += 1
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+            futures = [executor.submit(work) for _ in range(max(1, args.concurrency))]
+            results = [future.result() for future in futures]
+    finally:
+        stop.set()
+        heartbeat_thread.join()
+        if upload_registry is not None:
+            upload_registry.shutdown()
+
+    succeeded = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    counts = queue.counts()
+    if failed:
+        print(f"⚠️ {failed} attempts failed; failed jobs are retried up to {args.max_attempts} times")
+    print(
+        f"✨ Worker {worker} extracted {succeeded} MPs. Queue: {counts['pending']} pending, "
+        f"{counts['running']} running, {counts['done']} done, {counts['failed']} failed"
+    )
+
+
+def load_extract_manifest():
+    # {source_file: content hash of the sub-PDF its JSON was extracted from}
+    try:
+        with open(os.path.join(args.output_dir, EXTRACT_MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_extracted_hash(pdf_path):
+    # Remember which content of the sub-PDF an MP's JSON was extracted from. Queue workers may
+    # share the output directory, so the manifest is re-read and merged under a file lock.
+    content_hash = (split_hashes or {}).get(get_source_file(pdf_path))
+    if content_hash is None:
+        return
+    manifest_path = os.path.join(args.output_dir, EXTRACT_MANIFEST_NAME)
+    with extract_manifest_lock, file_lock(f"{manifest_path}.lock"):
+        manifest = load_extract_manifest()
+        manifest[get_source_file(pdf_path)] = content_hash
+        tmp_path = f"{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(manifest.items())), f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+
+def content_changed(pdf_path, extracted_hashes):
+    # Whether the sub-PDF content an MP was extracted from differs from the current split. Only
+    # content hashes count, so re-splitting, copying or checking out temp/ changes nothing; an
+    # MP extracted before either hash was known counts as unchanged.
+    source_file = get_source_file(pdf_path)
+    extracted_hash = extracted_hashes.get(source_file)
+    current_hash = (split_hashes or {}).get(source_file)
+    return extracted_hash is not None and current_hash is not None and extracted_hash != current_hash
+
+
+def is_stale(pdf_path, extracted_hashes):
+    # A missing JSON, or one extracted from content that has changed since
+    if not os.path.exists(os.path.join(args.output_dir, f"{get_source_file(pdf_path)}.json")):
+        return True
+    return content_changed(pdf_path, extracted_hashes)
+
+
+def setup(argv=None):
+    # Parse the command line (or argv) and set up the backend it selects, with its rate limiter,
+    # the extraction cache, the upload registry and the content hashes of the current split
+    global args, backend, rate_limiter, extraction_cache, extraction_key_fingerprint, upload_registry, split_hashes
+    global request_slots, section_executor
+    args = build_arg_parser().parse_args(argv)
+    request_slots = threading.BoundedSemaphore(max(1, args.concurrency))
+    if section_executor is not None:
+        section_executor.shutdown()
+    section_executor = ThreadPoolExecutor(max_workers=max(1, args.concurrency))
+    split_manifest = load_split_manifest("./temp")
+    split_hashes = None
+    if split_manifest:
+        split_hashes = {Path(file_name).stem: mp["sha256"] for file_name, mp in split_manifest["mps"].items()}
+    backend = create_backend(args)
+
+    # Configure the client-side rate limiter for the chosen backend
+    default_rpm, default_tpm = BACKEND_RATE_LIMITS[backend.name]
+    rate_limiter = RateLimiter(
+        args.rpm if args.rpm is not None else default_rpm,
+        args.tpm if args.tpm is not None else default_tpm,
+    )
+
+    # Set up the extraction cache shared by all workers
+    extraction_cache = extraction_key_fingerprint = None
+    if not args.no_cache:
+        extraction_cache = ExtractionCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+        extraction_key_fingerprint = backend_fingerprint()
+
+    # Backends that upload files get the upload registry; the fake backend's mock uploads are not persisted
+    upload_registry = None
+    if backend.upload_api is not None and not args.text_mode:
+        upload_registry = UploadRegistry(
+            backend.upload_api,
+            None if backend.name == "fake" else args.upload_registry,
+            args.upload_concurrency,
+            call_with_retries,
+        )
+    return args
+
+
+def main(argv=None):
+    try:
+        setup(argv)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if args.metrics:
+        metrics.configure(args.metrics, args.metrics_format)
+
     # Find all MP PDFs in the temp directory, sorted by number
     # The sort key extracts the MP number from filenames with 3-digit padding (e.g., mp_001.pdf)
     mp_pdfs = sorted(
@@ -397,18 +1632,29 @@ def main():
         print("Please run split.py first to split the PDF into individual MP files")
         sys.exit(1)
 
-    # Create jsons directory if it doesn't exist
-    os.makedirs("./jsons", exist_ok=True)
+    # With a split manifest, the content hash of every sub-PDF is known and compared with the
+    # one each JSON was extracted from
+    track_changes = split_hashes is not None
+    extracted_hashes = load_extract_manifest()
+    if args.changed_only:
+        mp_pdfs = [pdf_path for pdf_path in mp_pdfs if track_changes and is_stale(pdf_path, extracted_hashes)]
+        print(f"Limiting to the {len(mp_pdfs)} MPs whose sub-PDF changed since their JSON was written")
 
-    # Check which MPs have already been processed by examining the jsons folder
-    existing_jsons = glob.glob("./jsons/mp_*.json")
+    # Create output directory if it doesn't exist
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Check which MPs have already been processed by examining the output folder
+    existing_jsons = glob.glob(os.path.join(args.output_dir, "mp_*.json"))
     processed_mp_numbers = set()
 
-    if existing_jsons:
+    if existing_jsons and not args.force:
         for json_path in existing_jsons:
-            mp_num = int(json_path.split("_")[1].split(".")[0])
-            processed_mp_numbers.add(mp_num)
+            # Stubs of unparseable responses left by older runs are extracted again
+            if is_extracted(json_path):
+                mp_num = int(Path(json_path).stem.split("_")[1])
+                processed_mp_numbers.add(mp_num)
 
+    if processed_mp_numbers:
         latest_processed = max(processed_mp_numbers)
         print(
             f"Found {len(processed_mp_numbers)} already processed MPs. Latest is mp_{latest_processed:03d}.json"
@@ -418,12 +1664,25 @@ def main():
     unprocessed_mp_pdfs = []
     for pdf_path in mp_pdfs:
         mp_num = int(pdf_path.split("_")[1].split(".")[0])
-        if mp_num not in processed_mp_numbers:
+        if mp_num not in processed_mp_numbers or (track_changes and is_stale(pdf_path, extracted_hashes)):
             unprocessed_mp_pdfs.append(pdf_path)
 
+    if args.queue:
+        if args.jsonl:
+            print("Error: --queue and --jsonl cannot be combined")
+            sys.exit(1)
+        # MPs with a parsed, up-to-date JSON are done when they are first added to the queue
+        done = {get_source_file(pdf_path) for pdf_path in mp_pdfs if pdf_path not in unprocessed_mp_pdfs}
+        extract_from_queue(mp_pdfs, done)
+        metrics.finish()
+        return
+
+    if args.jsonl:
+        unprocessed_mp_pdfs = resume_jsonl(unprocessed_mp_pdfs, extracted_hashes)
+
     if not unprocessed_mp_pdfs:
         print("All MPs have already been processed! Nothing to do.")
-        print("If you want to reprocess, delete files from the ./jsons/ directory.")
+        print(f"If you want to reprocess, delete files from the {args.output_dir} directory.")
         sys.exit(0)
 
     print(
@@ -435,51 +1694,30 @@ def main():
         unprocessed_mp_pdfs = unprocessed_mp_pdfs[: args.limit]
         print(f"Limiting to {args.limit} MPs as requested")
 
-    # Choose the appropriate extraction function based on API selection
-    if use_openai:
-        print(
-            f"Processing {len(unprocessed_mp_pdfs)} MP PDFs with detailed extraction using OpenAI"
-        )
-        extract_function = extract_mp_data_with_openai
-    else:
-        print(
-            f"Processing {len(unprocessed_mp_pdfs)} MP PDFs with detailed extraction using Gemini"
-        )
-        extract_function = extract_mp_data_with_gemini
+    print(f"Processing {len(unprocessed_mp_pdfs)} MP PDFs with {backend.description}")
 
-    # Process the PDFs and extract structured data
-    all_mp_data = []
-    for i, pdf_path in enumerate(unprocessed_mp_pdfs):
-        # Get the MP number from the PDF filename
-        mp_num = int(pdf_path.split("_")[1].split(".")[0])
-        json_path = f"./jsons/mp_{mp_num:03d}.json"
-
-        # Extract structured MP data
-        print(f"⌛ Extracting data from MP {mp_num} PDF ({pdf_path})...")
-        data = extract_function(pdf_path)
-
-        # Extract and print name if available
-        name = None
-        # Check original schema
-        if data and isinstance(data, dict):
-            if "declarant" in data and "name" in data["declarant"]:
-                name = data["declarant"]["name"]
-            # Check new schema
-            elif "nyilatkozattevo_nev" in data:
-                name = data["nyilatkozattevo_nev"]
-
-        if name:
-            print(f"✅ Extraction successful: {name}")
-        else:
-            print("❌ Could not extract name from the data")
+    batches = plan_requests(unprocessed_mp_pdfs)
 
-        # Save individual MP data to a JSON file
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        print(f"💾 Saved MP data to {json_path}")
+    if args.jsonl:
+        extract_to_jsonl(batches, backend.extract_batch, extract_in_sections)
+        metrics.finish()
+        return
 
-        # Add to our aggregated results list
-        all_mp_data.append(data)
+    # Process the PDFs with at most args.concurrency requests in flight.
+    # Each JSON is written as soon as its MP completes; the aggregate keeps the PDF order.
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        futures = [
+            executor.submit(process_mp_batch, batch, backend.extract_batch, extract_in_sections)
+            for batch in batches
+        ]
+        results_by_pdf = {}
+        for batch, future in zip(batches, futures):
+            results_by_pdf.update(zip(batch, future.result()))
+        results = [results_by_pdf[pdf_path] for pdf_path in unprocessed_mp_pdfs]
+    if upload_registry is not None:
+        upload_registry.shutdown()
+    all_mp_data = [data for data in results if data is not None]
+    failed_count = len(results) - len(all_mp_data)
 
     # Save the aggregated results to mp_data.json as well
     with open("mp_data.json", "w", encoding="utf-8") as f:
@@ -490,9 +1728,14 @@ def main():
     if args.print:
         print(json.dumps(all_mp_data, indent=2, ensure_ascii=False))
 
+    if failed_count:
+        print(
+            f"⚠️ {failed_count} MPs failed, see {os.path.join(args.output_dir, 'errors')}. Run again to retry them."
+        )
     print(
-        f"✨ Successfully processed {len(unprocessed_mp_pdfs)} MPs. Run again to continue with more MPs if available."
+        f"✨ Successfully processed {len(all_mp_data)} MPs. Run again to continue with more MPs if available."
     )
+    metrics.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,212 @@
+import os
+import re
+import json
+import time
+import argparse
+import unicodedata
+from bisect import bisect_left
+
+from aggregates import get_path
+from export import write_json
+
+# Searchable fields: name -> paths of the values in a declaration. A path element ending in []
+# is a list whose items are searched.
+INDEX_FIELDS = {
+    "telepules": [("vagyonyi_nyilatkozat", "ingatlanok[]", "telepules")],
+    "szervezet": [
+        ("jovedelemnyilatkozat", "elozo_3_ev_foglalkozasai[]", "szervezet"),
+        ("jovedelemnyilatkozat", "aktualis_foglalkozasok[]", "szervezet"),
+        ("jovedelemnyilatkozat", "alkalmi_jovedelem_2m_felett[]", "szervezet"),
+        ("gazdasagi_erdekeltsegi_nyilatkozat", "tagsag_vagy_tisztseg_gazdalkodo_szervezetben[]", "szervezet"),
+        ("gazdasagi_erdekeltsegi_nyilatkozat", "befolyassal_biro_gazdasagi_erdekeltsegek[]", "gazdasagi_tarsasag_neve"),
+        # A few declarations have a single membership or interest without the list around it
+        ("gazdasagi_erdekeltsegi_nyilatkozat", "szervezet"),
+        ("gazdasagi_erdekeltsegi_nyilatkozat", "gazdasagi_tarsasag_neve"),
+    ],
+    "marka": [("vagyonyi_nyilatkozat", "nagy_erteku_ingok", "gepjarmuvek[]", "marka")],
+    "kibocsato": [("vagyonyi_nyilatkozat", "nagy_erteku_ingok", "ertekpapir_vagy_egyeb_befektetes[]", "kibocsato")],
+}
+
+# Abbreviations indexed and searched as the word they stand for
+TOKEN_ALIASES = {"bp": "budapest"}
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+DEFAULT_OUTPUT = os.path.join("..", "frontend", "public", "data", "search_index.json")
+
+
+def fold(text):
+    # Case- and accent-insensitive form: "Hódmezővásárhely" -> "hodmezovasarhely"
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    # Folded words of a value; "Bp. XI. ker." -> ["budapest", "xi", "ker"]
+    if not isinstance(text, str):
+        return []
+    return [TOKEN_ALIASES.get(token, token) for token in TOKEN_PATTERN.findall(fold(text))]
+
+
+def field_values(mp, path):
+    # Values at a path of INDEX_FIELDS in one declaration
+    values = [mp]
+    for key in path:
+        is_list = key.endswith("[]")
+        key = key[:-2] if is_list else key
+        next_values = []
+        for value in values:
+            value = get_path(value, key)
+            if is_list:
+                next_values.extend(item for item in value or [] if isinstance(item, dict))
+            elif value is not None:
+                next_values.append(value)
+        values = next_values
+    return [value for value in values if isinstance(value, str)]
+
+
+def delta_encode(doc_ids):
+    # Sorted doc ids as gaps, which are small numbers and serialize compactly
+    previous = 0
+    gaps = []
+    for doc_id in doc_ids:
+        gaps.append(doc_id - previous)
+        previous = doc_id
+    return gaps
+
+
+def delta_decode(gaps):
+    doc_ids = []
+    total = 0
+    for gap in gaps:
+        total += gap
+        doc_ids.append(total)
+    return doc_ids
+
+
+def build_index(releases):
+    # releases is {release: [declarations]} (release None for a single dataset). Every
+    # declaration of every release is one document: [release, source_file, name].
+    docs = []
+    postings = {field: {} for field in INDEX_FIELDS}
+    for release, mps in releases.items():
+        for mp in mps:
+            doc_id = len(docs)
+            docs.append([release, mp.get("source_file"), mp.get("nyilatkozattevo_nev")])
+            for field, paths in INDEX_FIELDS.items():
+                for path in paths:
+                    for value in field_values(mp, path):
+                        for token in tokenize(value):
+                            doc_ids = postings[field].setdefault(token, [])
+                            if not doc_ids or doc_ids[-1] != doc_id:
+                                doc_ids.append(doc_id)
+    return {
+        "version": 1,
+        "fields": list(INDEX_FIELDS),
+        "aliases": TOKEN_ALIASES,
+        "docs": docs,
+        # field -> {token: delta-encoded doc ids}, tokens in sorted order for prefix lookups
+        "terms": {
+            field: {token: delta_encode(terms[token]) for token in sorted(terms)}
+            for field, terms in postings.items()
+        },
+    }
+
+
+class SearchIndex:
+    # Loaded index: posting lists are decoded into sets once, so a lookup is a dict access
+    # per token plus set intersections
+    def __init__(self, index):
+        self.docs = index["docs"]
+        self.fields = index["fields"]
+        self.terms = {
+            field: {token: frozenset(delta_decode(gaps)) for token, gaps in terms.items()}
+            for field, terms in index["terms"].items()
+        }
+        self.sorted_terms = {field: list(terms) for field, terms in self.terms.items()}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def token_docs(self, field, token, prefix=False):
+        if not prefix:
+            return self.terms[field].get(token, frozenset())
+        # Union of every token starting with the prefix, found by bisecting the sorted tokens
+        sorted_terms = self.sorted_terms[field]
+        doc_ids = set()
+        for i in range(bisect_left(sorted_terms, token), len(sorted_terms)):
+            if not sorted_terms[i].startswith(token):
+                break
+            doc_ids |= self.terms[field][sorted_terms[i]]
+        return doc_ids
+
+    def search(self, text, field=None, prefix=False):
+        # Documents in which one field contains every word of text, in document order.
+        # With prefix, the last word also matches longer words (for search as you type).
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        doc_ids = set()
+        for name in [field] if field else self.fields:
+            matches = None
+            for i, token in enumerate(tokens):
+                found = self.token_docs(name, token, prefix and i == len(tokens) - 1)
+                matches = found if matches is None else matches & found
+                if not matches:
+                    break
+            doc_ids |= matches or set()
+        return [self.docs[doc_id] for doc_id in sorted(doc_ids)]
+
+
+def load_releases(inputs):
+    # PATH or RELEASE=PATH arguments, like analytics.py
+    if len(inputs) == 1 and "=" not in inputs[0]:
+        with open(inputs[0], "r", encoding="utf-8") as f:
+            return {None: json.load(f)}
+    releases = {}
+    for item in inputs:
+        release, _, path = item.rpartition("=")
+        with open(path, "r", encoding="utf-8") as f:
+            releases[release or os.path.splitext(os.path.basename(path))[0]] = json.load(f)
+    return releases
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build an accent-insensitive search index over the declarations, or query it"
+    )
+    parser.add_argument(
+        "--input",
+        nargs="+",
+        default=[os.path.join("jsons", "combined.json")],
+        help="Combined JSON to index, or several RELEASE=PATH arguments to index releases together (default: jsons/combined.json)",
+    )
+    parser.add_argument(
+        "--output",
+        default=DEFAULT_OUTPUT,
+        help="Index file to write, or to query with --query (default: ../frontend/public/data/search_index.json)",
+    )
+    parser.add_argument("--query", help="Search the index instead of building it, e.g. 'Veszprém'")
+    parser.add_argument("--field", choices=list(INDEX_FIELDS), help="Only search this field with --query")
+    parser.add_argument("--prefix", action="store_true", help="Let the last word of --query match as a prefix")
+    args = parser.parse_args()
+
+    if args.query:
+        search_index = SearchIndex.load(args.output)
+        start = time.perf_counter()
+        results = search_index.search(args.query, args.field, args.prefix)
+        elapsed_us = (time.perf_counter() - start) * 1_000_000
+        for release, source_file, name in results:
+            print(f"  {release + ' ' if release else ''}{source_file}: {name}")
+        print(f"🔎 {len(results)} matches for '{args.query}' in {elapsed_us:.0f} µs")
+    else:
+        index = build_index(load_releases(args.input))
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        write_json(args.output, index)
+        token_count = sum(len(terms) for terms in index["terms"].values())
+        print(
+            f"💾 Saved index of {len(index['docs'])} declarations and {token_count} tokens to {args.output} "
+            f"({os.path.getsize(args.output) / 1024:.1f} KB)"
+        )
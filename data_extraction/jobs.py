@@ -0,0 +1,195 @@
+import os
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+from cache import file_sha256
+
+DEFAULT_QUEUE = "./jobs.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    source_file TEXT PRIMARY KEY,
+    pdf_path TEXT NOT NULL,
+    pdf_sha256 TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    backend TEXT,
+    started_at REAL,
+    finished_at REAL,
+    seconds REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+"""
+
+STATES = ["pending", "running", "done", "failed"]
+
+
+def default_worker_id():
+    # Unique across the machines sharing a queue and the processes on one machine
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    # Durable queue of per-MP extraction jobs in a SQLite file. Workers claim jobs with a lease
+    # and renew it while they work; a job whose lease expired (its worker crashed or was killed)
+    # is claimed again by the next worker. Several processes, or machines on a shared filesystem,
+    # can drain the same queue. Every thread gets its own connection.
+    def __init__(self, path=DEFAULT_QUEUE, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            # The rollback journal (not WAL) also works on network filesystems; timeout waits
+            # for other workers' transactions instead of failing with "database is locked"
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            self.local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't claim the same job
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def sync(self, pdf_paths, done=(), force=False):
+        # Add a job for every new sub-PDF (already done if in `done`, e.g. an existing JSON) and
+        # requeue the jobs whose PDF changed since they were added; force requeues every job.
+        # Returns the number of jobs added or requeued.
+        hashes = {pdf_path: file_sha256(pdf_path) for pdf_path in pdf_paths}
+        queued = 0
+        with self.transaction() as db:
+            known = {
+                row["source_file"]: row
+                for row in db.execute("SELECT source_file, pdf_sha256, state FROM jobs")
+            }
+            for pdf_path, sha256 in hashes.items():
+                source_file = os.path.splitext(os.path.basename(pdf_path))[0]
+                row = known.get(source_file)
+                if row is None:
+                    state = "done" if source_file in done and not force else "pending"
+                    db.execute(
+                        "INSERT INTO jobs (source_file, pdf_path, pdf_sha256, state) VALUES (?, ?, ?, ?)",
+                        (source_file, pdf_path, sha256, state),
+                    )
+                    queued += state == "pending"
+                elif row["pdf_sha256"] != sha256 or (force and row["state"] != "running"):
+                    db.execute(
+                        "UPDATE jobs SET pdf_path = ?, pdf_sha256 = ?, state = 'pending', attempts = 0, "
+                        "worker = NULL, lease_expires = NULL, error = NULL WHERE source_file = ?",
+                        (pdf_path, sha256, source_file),
+                    )
+                    queued += 1
+        return queued
+
+    def claim(self, worker, lease_seconds, limit=1, backend=None):
+        # Lease up to `limit` pending or abandoned jobs to the worker; returns their PDF paths
+        now = time.time()
+        with self.transaction() as db:
+            # Abandoned jobs that used up their attempts are not retried again
+            db.execute(
+                "UPDATE jobs SET state = 'failed', error = COALESCE(error, 'lease expired') "
+                "WHERE state = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            rows = db.execute(
+                "SELECT source_file, pdf_path FROM jobs "
+                "WHERE state = 'pending' OR (state = 'running' AND lease_expires < ?) "
+                "ORDER BY source_file LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            for row in rows:
+                db.execute(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, "
+                    "lease_expires = ?, backend = ?, started_at = ?, finished_at = NULL, seconds = NULL "
+                    "WHERE source_file = ?",
+                    (worker, now + lease_seconds, backend, now, row["source_file"]),
+                )
+        return [row["pdf_path"] for row in rows]
+
+    def renew(self, worker, lease_seconds):
+        # Extend the leases of all jobs the worker is still running (its heartbeat)
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE state = 'running' AND worker = ?",
+                (time.time() + lease_seconds, worker),
+            )
+
+    def finish(self, source_file, worker, error=None):
+        # Mark a job done, or failed with its error. A failed job goes back to pending until it
+        # has used up its attempts. Jobs another worker reclaimed in the meantime are left alone.
+        now = time.time()
+        with self.transaction() as db:
+            if error is None:
+                state = "'done'"
+            else:
+                state = "CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END"
+            db.execute(
+                f"UPDATE jobs SET state = {state}, worker = NULL, lease_expires = NULL, "
+                "finished_at = ?, seconds = ? - started_at, error = ? "
+                "WHERE source_file = ? AND worker = ? AND state = 'running'",
+                ([self.max_attempts] if error is not None else []) + [now, now, error, source_file, worker],
+            )
+
+    def retry_failed(self):
+        with self.transaction() as db:
+            count = db.execute(
+                "UPDATE jobs SET state = 'pending', attempts = 0, error = NULL WHERE state = 'failed'"
+            ).rowcount
+        return count
+
+    def counts(self):
+        # {state: number of jobs}, with expired leases counted as pending
+        counts = dict.fromkeys(STATES, 0)
+        rows = self.connection().execute(
+            "SELECT CASE WHEN state = 'running' AND lease_expires < ? THEN 'pending' ELSE state END AS state, "
+            "COUNT(*) AS count FROM jobs GROUP BY 1",
+            (time.time(),),
+        )
+        for row in rows:
+            counts[row["state"]] = row["count"]
+        return counts
+
+    def jobs(self, state=None):
+        query = "SELECT * FROM jobs" + (" WHERE state = ?" if state else "") + " ORDER BY source_file"
+        return [dict(row) for row in self.connection().execute(query, [state] if state else [])]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or manage the extraction job queue of extract.py --queue")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE, help=f"Job queue file (default: {DEFAULT_QUEUE})")
+    parser.add_argument("--retry-failed", action="store_true", help="Give the failed jobs a new set of attempts")
+    parser.add_argument("--list", choices=STATES, help="List the jobs in this state")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.queue):
+        print(f"Error: no job queue at {args.queue}, run extract.py --queue first")
+        raise SystemExit(1)
+    queue = JobQueue(args.queue)
+    if args.retry_failed:
+        print(f"🔁 Requeued {queue.retry_failed()} failed jobs")
+    if args.list:
+        for job in queue.jobs(args.list):
+            seconds = f" {job['seconds']:.1f}s" if job["seconds"] is not None else ""
+            detail = f" on {job['worker']}" if job["state"] == "running" else ""
+            error = f": {job['error']}" if job["error"] else ""
+            print(f"  {job['source_file']} ({job['attempts']} attempts{seconds}{detail}){error}")
+    counts = queue.counts()
+    print("📋 " + ", ".join(f"{counts[state]} {state}" for state in STATES))
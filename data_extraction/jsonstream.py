@@ -0,0 +1,148 @@
+import json
+
+
+class IncrementalJSONParser:
+    # Scans LLM output chunk by chunk for the first top-level JSON object or array.
+    # feed() returns True as soon as the root value closes, so a stream can be cancelled early.
+    # A root that closes but is not JSON (e.g. "{mp_001}" or "[Note]" in the text before a
+    # ```json fence) is skipped and the scan goes on from the next bracket after it.
+    # If the text ends before that, result() repairs the truncated JSON by cutting it back
+    # to the last complete value and closing the open containers.
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0  # Number of characters fed so far
+        self.start = None  # Offset of the root '{' or '['
+        self.end = None  # Offset just past the root's closing bracket
+        self.closers = []  # Closing brackets of the open containers, innermost last
+        self.in_string = False
+        self.escaped = False
+        self.expect_key = False  # Whether a string in the current object would be a key
+        self.string_is_key = False
+        self.checkpoint = None  # (cut offset, closers) of the last point where the JSON can be closed
+        self.value = None  # The parsed root once it is complete
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    def feed(self, chunk):
+        if self.complete or not chunk:
+            return self.complete
+        self.chunks.append(chunk)
+        base = self.offset
+        self.offset += len(chunk)
+        return self._scan(chunk, base)
+
+    def _scan(self, text, base):
+        i = 0
+        while i < len(text):
+            char = text[i]
+            position = base + i
+            i += 1
+            if self.start is None:
+                # Skip anything before the JSON, e.g. a ```json fence
+                if char in "{[":
+                    self.start = position
+                    self._open(char, position)
+                continue
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    # A closed string value (not a key) can be the last value before a cut
+                    if not self.string_is_key:
+                        self._checkpoint(position + 1)
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_is_key = self.closers[-1] == "}" and self.expect_key
+            elif char in "{[":
+                self._open(char, position)
+            elif char in "}]":
+                self.closers.pop()
+                if not self.closers:
+                    self.end = position + 1
+                    if self._parse_root():
+                        return True
+                    # Not JSON: rescan the text after the rejected root's opening bracket
+                    restart = self.start + 1
+                    self._reset()
+                    text = self.text()[restart:]
+                    base = restart
+                    i = 0
+                    continue
+                self.expect_key = False
+                self._checkpoint(position + 1)
+            elif char == ",":
+                # Everything before the comma is complete
+                self._checkpoint(position)
+                self.expect_key = self.closers[-1] == "}"
+            elif char == ":":
+                self.expect_key = False
+        return False
+
+    def _open(self, char, position):
+        # A container opened as a list element is no checkpoint: cutting there would leave an
+        # empty phantom item ([{...},{} ), so a cut goes back to before its opening bracket
+        in_list = bool(self.closers) and self.closers[-1] == "]"
+        self.closers.append("}" if char == "{" else "]")
+        self.expect_key = char == "{"
+        if not in_list:
+            self._checkpoint(position + 1)
+
+    def _reset(self):
+        self.start = self.end = self.checkpoint = None
+        self.closers = []
+        self.in_string = self.escaped = self.expect_key = self.string_is_key = False
+
+    def _parse_root(self):
+        try:
+            self.value = json.loads(self.text()[self.start : self.end])
+        except (json.JSONDecodeError, RecursionError):
+            return False
+        return True
+
+    def _checkpoint(self, cut):
+        self.checkpoint = (cut, "".join(reversed(self.closers)))
+
+    def text(self):
+        return "".join(self.chunks)
+
+    def result(self):
+        # Returns (data, truncated); data is None if no JSON could be recovered
+        if self.start is None:
+            return None, False
+        if self.complete:
+            return self.value, False
+        text = self.text()
+
+        # Truncated inside a string value: keep the partial string and close everything
+        if self.in_string and not self.string_is_key:
+            partial = text[self.start :]
+            if self.escaped:
+                partial = partial[:-1]
+            try:
+                return json.loads(partial + '"' + "".join(reversed(self.closers))), True
+            except (json.JSONDecodeError, RecursionError):
+                pass
+
+        # Otherwise close the containers that were open at the last complete value
+        cut, closers = self.checkpoint
+        try:
+            return json.loads(text[self.start : cut] + closers), True
+        except (json.JSONDecodeError, RecursionError):
+            return None, True
+
+
+def parse_json_stream(chunks):
+    # Feed text chunks until the root JSON value is complete; stops consuming the stream early
+    parser = IncrementalJSONParser()
+    for chunk in chunks:
+        if parser.feed(chunk):
+            break
+    return parser
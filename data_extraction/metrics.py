@@ -0,0 +1,158 @@
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+# Stages of the pipeline in the order they happen, for the summary table
+STAGE_ORDER = ["scan", "hash", "write", "text", "upload", "llm", "parse", "mp"]
+
+
+def percentile(sorted_values, q):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Metrics:
+    # Thread-safe collector of per-stage timings and counters. Every timed event is appended
+    # to a JSON Lines file as it happens (if a path is set); only the durations are kept in
+    # memory for the end-of-run summary.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.output = None
+        self.durations = {}  # stage -> [seconds]
+        self.counters = {}  # name -> value
+        self.slowest = {}  # stage -> [(seconds, label)] of the slowest events
+        self.prometheus_path = None
+
+    def open(self, path):
+        # Start appending events to a JSON Lines file
+        self.close()
+        self.output = open(path, "a", encoding="utf-8")
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+
+    @contextmanager
+    def labels(self, **labels):
+        # Labels (e.g. mp="mp_004") added to every event recorded by this thread inside the block
+        previous = getattr(self.local, "labels", {})
+        self.local.labels = {**previous, **labels}
+        try:
+            yield
+        finally:
+            self.local.labels = previous
+
+    def record(self, stage, seconds, **fields):
+        event = {
+            "time": round(time.time(), 3),
+            "stage": stage,
+            "seconds": round(seconds, 6),
+            **getattr(self.local, "labels", {}),
+            **fields,
+        }
+        with self.lock:
+            self.durations.setdefault(stage, []).append(seconds)
+            label = event.get("mp")
+            if label:
+                slowest = self.slowest.setdefault(stage, [])
+                slowest.append((seconds, label))
+                slowest.sort(reverse=True)
+                del slowest[5:]
+            if self.output is not None:
+                self.output.write(json.dumps(event, ensure_ascii=False) + "\n")
+                self.output.flush()
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        # Time the block; the yielded dict can be filled with extra fields such as token counts
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, **fields)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        # {stage: {count, total, p50, p95, max}} plus the counters
+        with self.lock:
+            stages = {}
+            for stage in sorted(self.durations, key=lambda s: (STAGE_ORDER + [s]).index(s)):
+                values = sorted(self.durations[stage])
+                stages[stage] = {
+                    "count": len(values),
+                    "total": sum(values),
+                    "p50": percentile(values, 0.5),
+                    "p95": percentile(values, 0.95),
+                    "max": values[-1],
+                }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary["stages"] and not summary["counters"]:
+            return
+        print("\n📊 Timing per stage (seconds):")
+        print(f"{'stage':<8} {'count':>6} {'total':>9} {'p50':>8} {'p95':>8} {'max':>8}")
+        for stage, values in summary["stages"].items():
+            print(
+                f"{stage:<8} {values['count']:>6} {values['total']:>9.2f} "
+                f"{values['p50']:>8.3f} {values['p95']:>8.3f} {values['max']:>8.3f}"
+            )
+        if summary["counters"]:
+            print("   " + ", ".join(f"{name}: {value}" for name, value in sorted(summary["counters"].items())))
+        with self.lock:
+            slowest_mps = list(self.slowest.get("mp", []))
+        if slowest_mps:
+            print("   Slowest MPs: " + ", ".join(f"{label} ({seconds:.1f}s)" for seconds, label in slowest_mps))
+
+    def prometheus(self, prefix="neked_dolgoznak"):
+        # Prometheus text exposition format: one summary per stage and one counter per counter
+        summary = self.summary()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Duration of the pipeline stages",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, values in summary["stages"].items():
+            for quantile in ("p50", "p95"):
+                lines.append(
+                    f'{prefix}_stage_seconds{{stage="{stage}",quantile="0.{quantile[1:]}"}} {values[quantile]:.6f}'
+                )
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {values["total"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def configure(self, path, format="jsonl"):
+        # Output of a run: JSON Lines events as they happen, or Prometheus text at the end
+        if format == "jsonl":
+            self.open(path)
+        else:
+            self.prometheus_path = path
+
+    def finish(self):
+        # Print the summary and write the Prometheus file if one was requested
+        self.print_summary()
+        self.close()
+        if self.prometheus_path:
+            with open(self.prometheus_path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus())
+            print(f"💾 Saved metrics to {self.prometheus_path}")
+
+
+# Shared by split.py, extract.py and uploads.py
+metrics = Metrics()
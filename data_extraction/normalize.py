@@ -0,0 +1,296 @@
+import os
+import re
+import json
+import glob
+import time
+import argparse
+import unicodedata
+from functools import lru_cache
+
+# Post-extraction normalization of the mechanical parts of a declaration (brand names, currency
+# codes, fractions, amounts), so the extraction prompt doesn't have to ask for them. Capitalization
+# is still asked of the model, which can tell a person's name from an acronym in any field; the
+# settlement and declarant names, which are always names, are recapitalized here as well.
+# Rules are looked up by key name and memoized, so each distinct value is normalized once per run.
+
+# Folded brand name -> canonical brand name
+BRANDS = {
+    "vw": "Volkswagen",
+    "volkswagen": "Volkswagen",
+    "mercedes": "Mercedes-Benz",
+    "mercedes benz": "Mercedes-Benz",
+    "mercedes-benz": "Mercedes-Benz",
+    "mb": "Mercedes-Benz",
+    "skoda": "Škoda",
+    "citroen": "Citroën",
+    "kia": "Kia",
+    "seat": "SEAT",
+    "mini": "Mini",
+    "ssangyong": "SsangYong",
+    "land rover": "Land Rover",
+    "landrover": "Land Rover",
+    "alfa": "Alfa Romeo",
+    "alfa romeo": "Alfa Romeo",
+    "chevi": "Chevrolet",
+    "chevy": "Chevrolet",
+    "bmw": "BMW",
+    "toyota": "Toyota",
+    "opel": "Opel",
+    "volvo": "Volvo",
+    "suzuki": "Suzuki",
+    "ford": "Ford",
+    "renault": "Renault",
+    "honda": "Honda",
+    "audi": "Audi",
+    "dacia": "Dacia",
+    "mazda": "Mazda",
+    "nissan": "Nissan",
+    "peugeot": "Peugeot",
+    "hyundai": "Hyundai",
+    "mitsubishi": "Mitsubishi",
+    "tesla": "Tesla",
+    "fiat": "Fiat",
+    "lexus": "Lexus",
+}
+
+# Folded currency name or symbol -> ISO 4217 code
+CURRENCIES = {
+    "huf": "HUF",
+    "ft": "HUF",
+    "ft.": "HUF",
+    "forint": "HUF",
+    "magyar forint": "HUF",
+    "eur": "EUR",
+    "euro": "EUR",
+    "€": "EUR",
+    "usd": "USD",
+    "$": "USD",
+    "dollar": "USD",
+    "amerikai dollar": "USD",
+    "chf": "CHF",
+    "svajci frank": "CHF",
+    "gbp": "GBP",
+    "£": "GBP",
+    "font": "GBP",
+    "angol font": "GBP",
+}
+
+# Amounts that are not named *_huf but are currency balances too
+AMOUNT_KEYS = {"koztartozas", "nevertek"}
+
+MP_POSITION = "Országgyűlési képviselő"
+# "Országgyűlési Képviselő", "országgyűlési kepviselő", "OGY KÉPVISELŐ", "Országgyűlés képviselő", ... (folded)
+MP_POSITION_PATTERN = re.compile(r"(orszaggyulesi|orszaggyules|ogy\.?)\s+kepviselo(?![a-z])")
+
+# Words kept as written, or lowercased, when an all-caps name is recapitalized
+ROMAN_NUMERAL_PATTERN = re.compile(r"[IVX]+\.?")
+LOWERCASE_WORDS = {"ker.", "kerület", "és", "u.", "utca"}
+
+AMOUNT_PATTERN = re.compile(r"-?\d+(?:[.,]\d+)?")
+THOUSANDS_PATTERN = re.compile(r"-?\d{1,3}(?:\.\d{3})+")
+FRACTION_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*/\s*(\d+(?:[.,]\d+)?)")
+PERCENT_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*%")
+
+
+def _fold(text):
+    # "Országgyűlési Képviselő" -> "orszaggyulesi kepviselo"
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _to_float(text):
+    return float(text.replace(",", "."))
+
+
+@lru_cache(maxsize=None)
+def normalize_brand(value):
+    # VW -> Volkswagen, KIA -> Kia; unknown all-caps brands longer than an acronym are recapitalized
+    if not isinstance(value, str):
+        return value
+    value = " ".join(value.split())
+    brand = BRANDS.get(_fold(value))
+    if brand:
+        return brand
+    if value.isupper() and len(value) > 3:
+        return normalize_proper_name(value)
+    return value
+
+
+@lru_cache(maxsize=None)
+def normalize_currency(value):
+    # Forint, Ft, Huf -> HUF; no currency at all means HUF
+    if value is None:
+        return "HUF"
+    if not isinstance(value, str):
+        return value
+    folded = " ".join(_fold(value).split())
+    if folded in CURRENCIES:
+        return CURRENCIES[folded]
+    if len(folded) == 3 and folded.isalpha():
+        return folded.upper()
+    return value
+
+
+@lru_cache(maxsize=None, typed=True)
+def normalize_fraction(value):
+    # "1/2", "50%" and 0.3333 -> decimal number rounded to 2 places
+    if _is_number(value):
+        return round(float(value), 2)
+    if not isinstance(value, str):
+        return value
+    text = value.strip()
+    match = FRACTION_PATTERN.fullmatch(text)
+    if match and _to_float(match.group(2)):
+        return round(_to_float(match.group(1)) / _to_float(match.group(2)), 2)
+    match = PERCENT_PATTERN.fullmatch(text)
+    if match:
+        return round(_to_float(match.group(1)) / 100, 2)
+    if AMOUNT_PATTERN.fullmatch(text):
+        return round(_to_float(text), 2)
+    return value
+
+
+@lru_cache(maxsize=None, typed=True)
+def normalize_amount(value):
+    # Currency balances as whole numbers: 1500000.0 -> 1500000, "1.200.000 Ft" -> 1200000
+    if _is_number(value):
+        return int(round(value))
+    if not isinstance(value, str):
+        return value
+    text = re.sub(r"\s|ft\.?$|huf$", "", value.strip().casefold())
+    if THOUSANDS_PATTERN.fullmatch(text):
+        text = text.replace(".", "")
+    if AMOUNT_PATTERN.fullmatch(text):
+        return int(round(_to_float(text)))
+    return value
+
+
+@lru_cache(maxsize=None)
+def normalize_position(value):
+    # Any spelling of "Országgyűlési képviselő" at the start of a position, keeping what follows
+    if not isinstance(value, str):
+        return value
+    folded = _fold(value)
+    match = MP_POSITION_PATTERN.match(folded)
+    # Folding keeps Hungarian text the same length, so the match can be cut from the original
+    if not match or len(folded) != len(value):
+        return value
+    rest = value[match.end():]
+    return MP_POSITION if rest.strip() == "." else MP_POSITION + rest
+
+
+@lru_cache(maxsize=None)
+def normalize_proper_name(value):
+    # All-caps place and person names: "BUDAPEST XI. KER." -> "Budapest XI. ker."
+    if not isinstance(value, str) or not value.isupper():
+        return value
+    words = []
+    for word in value.split(" "):
+        if ROMAN_NUMERAL_PATTERN.fullmatch(word):
+            words.append(word)
+        elif word.lower() in LOWERCASE_WORDS:
+            words.append(word.lower())
+        else:
+            words.append("-".join(part.capitalize() for part in word.split("-")))
+    return " ".join(words)
+
+
+# Key name -> rule; keys ending in _huf and AMOUNT_KEYS are amounts. Only fields that always hold
+# a place or person name are recapitalized: others, such as hitelező, also hold acronyms like OTP.
+FIELD_RULES = {
+    "marka": normalize_brand,
+    "penznem": normalize_currency,
+    "tulajdoni_hanyad": normalize_fraction,
+    "foglalkozas_megbizas_tisztseg": normalize_position,
+    "tagsag_tisztseg": normalize_position,
+    "telepules": normalize_proper_name,
+    "nyilatkozattevo_nev": normalize_proper_name,
+}
+
+
+@lru_cache(maxsize=None)
+def rule_for(key):
+    if key in FIELD_RULES:
+        return FIELD_RULES[key]
+    if key.endswith("_huf") or key in AMOUNT_KEYS:
+        return normalize_amount
+    return None
+
+
+def normalize_declaration(data):
+    # Normalize an extracted declaration in place; returns the number of values changed
+    changed = 0
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(item for item in node if isinstance(item, (dict, list)))
+            continue
+        if not isinstance(node, dict):
+            continue
+        for key, value in node.items():
+            if isinstance(value, (dict, list)):
+                stack.append(value)
+                continue
+            rule = rule_for(key)
+            if rule is None:
+                continue
+            normalized = rule(value)
+            if type(normalized) is not type(value) or normalized != value:
+                node[key] = normalized
+                changed += 1
+    return changed
+
+
+def normalize_json_files(input_dir="jsons", check=False):
+    # Re-normalize the per-MP JSON files; only files that change are rewritten, so the
+    # incremental combine step re-reads just those
+    start = time.perf_counter()
+    paths = sorted(glob.glob(os.path.join(input_dir, "mp_*.json")))
+    changed_files = []
+    changed_values = 0
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        changed = normalize_declaration(data)
+        if not changed:
+            continue
+        changed_files.append(path)
+        changed_values += changed
+        if not check:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    action = "would change" if check else "changed"
+    print(
+        f"🧹 Normalization {action} {changed_values} values in {len(changed_files)} of {len(paths)} files "
+        f"({elapsed_ms:.0f} ms)"
+    )
+    return changed_files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-normalize the extracted per-MP JSON files without calling the model"
+    )
+    parser.add_argument(
+        "--input-dir",
+        default="jsons",
+        help="Directory of the mp_XXX.json files to normalize (default: ./jsons)",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only report what would change; exit with status 1 if any file is not normalized",
+    )
+    args = parser.parse_args()
+    changed_files = normalize_json_files(args.input_dir, args.check)
+    if args.check and changed_files:
+        for path in changed_files:
+            print(f"  {path}")
+        raise SystemExit(1)
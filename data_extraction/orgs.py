@@ -0,0 +1,266 @@
+import os
+import json
+import argparse
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+from export import write_json
+from index import INDEX_FIELDS, field_values, tokenize
+
+# Legal forms dropped from the end of an organization name (folded words), longest first, so
+# "Pátka Nafta Kft.", "PÁTKA NAFTA KFT" and "Pátka Nafta Korlátolt Felelősségű Társaság" are one name
+LEGAL_FORMS = sorted(
+    [
+        ("kft",),
+        ("zrt",),
+        ("nyrt",),
+        ("rt",),
+        ("bt",),
+        ("kkt",),
+        ("kht",),
+        ("kh",),
+        ("ev",),
+        ("nonprofit",),
+        ("kozhasznu",),
+        ("korlatolt", "felelossegu", "tarsasag"),
+        ("zartkoruen", "mukodo", "reszvenytarsasag"),
+        ("nyilvanosan", "mukodo", "reszvenytarsasag"),
+        ("reszvenytarsasag",),
+        ("beteti", "tarsasag"),
+        ("kozkereseti", "tarsasag"),
+        ("egyeni", "vallalkozo"),
+    ],
+    key=len,
+    reverse=True,
+)
+
+LEADING_ARTICLES = {"a", "az"}
+
+# Values the model writes where there is no organization
+NON_VALUES = {"nincs", "nem", "n a", "na", "none", "null", "egyeb"}
+
+DEFAULT_THRESHOLD = 0.9
+
+DEFAULT_OUTPUT = os.path.join("..", "frontend", "public", "data", "orgs.json")
+
+
+def org_key(name):
+    # Matching key of an organization name: folded words without the legal form and leading
+    # article; "" for values that name no organization ("Nincs", dates)
+    words = tokenize(name)
+    while words and words[0] in LEADING_ARTICLES:
+        words = words[1:]
+    stripped = True
+    while stripped:
+        stripped = False
+        for form in LEGAL_FORMS:
+            if len(words) > len(form) and tuple(words[-len(form):]) == form:
+                words = words[: -len(form)]
+                stripped = True
+                break
+    key = " ".join(words)
+    if key in NON_VALUES or not any(char.isalpha() for char in key):
+        return ""
+    return key
+
+
+def org_mentions(mp):
+    # (name, role) of every organization in a declaration; the role is the list it comes from,
+    # e.g. "aktualis_foglalkozasok" or "befolyassal_biro_gazdasagi_erdekeltsegek"
+    mentions = []
+    for path in INDEX_FIELDS["szervezet"]:
+        lists = [key[:-2] for key in path if key.endswith("[]")]
+        role = lists[-1] if lists else path[0]
+        mentions.extend((" ".join(name.split()), role) for name in field_values(mp, path))
+    return mentions
+
+
+def blocking_keys(key):
+    # Keys are only compared with keys sharing a block: the start of the first word or the
+    # longest word. Typos rarely hit both, and the number of comparisons stays near linear.
+    words = key.split()
+    return {("first", words[0][:4]), ("longest", max(words, key=len))}
+
+
+def numbers(key):
+    return [word for word in key.split() if word.isdigit()]
+
+
+def resolve(keys, threshold=DEFAULT_THRESHOLD):
+    # Cluster near-identical keys: {key: representative key}, with union-find over the
+    # pairs of a block whose similarity ratio reaches the threshold. Keys with different
+    # numbers are different organizations ("Pannon PR 2020" and "Pannon PR 2021").
+    parent = {key: key for key in keys}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    blocks = defaultdict(list)
+    for key in keys:
+        for block in blocking_keys(key):
+            blocks[block].append(key)
+
+    compared = set()
+    for members in blocks.values():
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                pair = (a, b) if a < b else (b, a)
+                if pair in compared or find(a) == find(b):
+                    continue
+                compared.add(pair)
+                if numbers(a) != numbers(b):
+                    continue
+                matcher = SequenceMatcher(None, a, b, autojunk=False)
+                if matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold:
+                    parent[find(b)] = find(a)
+    return {key: find(key) for key in keys}
+
+
+def build_graph(mps, threshold=DEFAULT_THRESHOLD):
+    # Bipartite MP <-> organization graph with both adjacency lists precomputed
+    mentions = []  # (mp id, name, key, role)
+    for mp_id, mp in enumerate(mps):
+        for name, role in org_mentions(mp):
+            key = org_key(name)
+            if key:
+                mentions.append((mp_id, name, key, role))
+
+    representative = resolve(sorted({key for _, _, key, _ in mentions}), threshold)
+
+    # One organization per cluster, named by its most common spelling
+    spellings = defaultdict(Counter)
+    for _, name, key, _ in mentions:
+        spellings[representative[key]][name] += 1
+    clusters = sorted(spellings, key=lambda cluster: spellings[cluster].most_common(1)[0][0].casefold())
+    org_ids = {cluster: org_id for org_id, cluster in enumerate(clusters)}
+
+    mp_orgs = [[] for _ in mps]
+    org_mps = [[] for _ in clusters]
+    for mp_id, _, key, role in mentions:
+        org_id = org_ids[representative[key]]
+        if [org_id, role] not in mp_orgs[mp_id]:
+            mp_orgs[mp_id].append([org_id, role])
+        if not org_mps[org_id] or org_mps[org_id][-1] != mp_id:
+            org_mps[org_id].append(mp_id)
+
+    orgs = []
+    for cluster in clusters:
+        names = [name for name, _ in spellings[cluster].most_common()]
+        orgs.append({"name": names[0], "aliases": names[1:]} if len(names) > 1 else {"name": names[0]})
+
+    return {
+        "version": 1,
+        "mps": [[mp.get("source_file"), mp.get("nyilatkozattevo_nev")] for mp in mps],
+        "orgs": orgs,
+        # mp id -> [[org id, role]], org id -> [mp ids]
+        "mp_orgs": mp_orgs,
+        "org_mps": org_mps,
+    }
+
+
+class OrgGraph:
+    # Loaded graph with lookups by source_file and organization name; the MPs sharing an
+    # organization with each MP are precomputed, so every query is a dict access
+    def __init__(self, graph):
+        self.mps = graph["mps"]
+        self.orgs = graph["orgs"]
+        self.mp_orgs = graph["mp_orgs"]
+        self.org_mps = graph["org_mps"]
+        self.mp_ids = {source_file: mp_id for mp_id, (source_file, _) in enumerate(self.mps)}
+        self.org_ids = {}
+        for org_id, org in enumerate(self.orgs):
+            for name in [org["name"]] + org.get("aliases", []):
+                self.org_ids[org_key(name)] = org_id
+        # mp id -> {other mp id: [shared org ids]}
+        self.neighbours = [defaultdict(list) for _ in self.mps]
+        for org_id, mp_ids in enumerate(self.org_mps):
+            for a in mp_ids:
+                for b in mp_ids:
+                    if a != b:
+                        self.neighbours[a][b].append(org_id)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def find_org(self, name):
+        # Organization id of a name in any spelling the graph has seen, or None
+        return self.org_ids.get(org_key(name))
+
+    def orgs_of(self, source_file):
+        # [(organization name, role)] of an MP
+        mp_id = self.mp_ids.get(source_file)
+        if mp_id is None:
+            return []
+        return [(self.orgs[org_id]["name"], role) for org_id, role in self.mp_orgs[mp_id]]
+
+    def mps_of(self, name):
+        # [(source_file, MP name)] tied to an organization
+        org_id = self.find_org(name)
+        if org_id is None:
+            return []
+        return [tuple(self.mps[mp_id]) for mp_id in self.org_mps[org_id]]
+
+    def shared(self, source_file):
+        # {(source_file, MP name): [organization names]} of the MPs sharing an organization with an MP
+        mp_id = self.mp_ids.get(source_file)
+        if mp_id is None:
+            return {}
+        return {
+            tuple(self.mps[other]): [self.orgs[org_id]["name"] for org_id in org_ids]
+            for other, org_ids in self.neighbours[mp_id].items()
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Resolve the organizations named in the declarations and build the MP <-> organization graph, or query it"
+    )
+    parser.add_argument(
+        "--input",
+        default=os.path.join("jsons", "combined.json"),
+        help="Combined JSON to build the graph from (default: jsons/combined.json)",
+    )
+    parser.add_argument(
+        "--output",
+        default=DEFAULT_OUTPUT,
+        help="Graph file to write, or to query with --org/--mp (default: ../frontend/public/data/orgs.json)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"Similarity from which two organization names are merged, 0-1 (default: {DEFAULT_THRESHOLD})",
+    )
+    parser.add_argument("--org", help="List the MPs tied to this organization, in any spelling")
+    parser.add_argument("--mp", help="List the organizations of this MP (source_file, e.g. mp_004) and the MPs sharing them")
+    args = parser.parse_args()
+
+    if args.org or args.mp:
+        graph = OrgGraph.load(args.output)
+        if args.org:
+            mps = graph.mps_of(args.org)
+            print(f"🏢 {len(mps)} MPs tied to '{args.org}'")
+            for source_file, name in mps:
+                print(f"  {source_file}: {name}")
+        if args.mp:
+            for name, role in graph.orgs_of(args.mp):
+                print(f"🏢 {name} ({role})")
+            for (source_file, name), org_names in graph.shared(args.mp).items():
+                print(f"  🤝 {source_file}: {name} via {', '.join(org_names)}")
+    else:
+        with open(args.input, "r", encoding="utf-8") as f:
+            mps = json.load(f)
+        graph = build_graph(mps, args.threshold)
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        write_json(args.output, graph)
+        merged = sum(1 for org in graph["orgs"] if org.get("aliases"))
+        shared = sum(1 for mp_ids in graph["org_mps"] if len(mp_ids) > 1)
+        print(
+            f"💾 Saved {len(graph['orgs'])} organizations ({merged} with several spellings, "
+            f"{shared} shared by several MPs) to {args.output}"
+        )
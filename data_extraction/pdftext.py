@@ -0,0 +1,163 @@
+import os
+import re
+from pathlib import Path
+
+from metrics import metrics
+
+try:
+    import pymupdf
+except ImportError:
+    import fitz as pymupdf
+
+# Pages with fewer non-whitespace characters than this are treated as scanned images
+MIN_TEXT_CHARS = 20
+
+# Table detection is slow, so it only runs on pages with the "Jövedelmi kategóriák" income tables
+TABLE_MARKER = "kategóri"
+
+
+def page_to_text(page):
+    # Layout-ordered text of a page with its tables rendered as Markdown,
+    # so the income category columns marked with an X keep their position
+    tables = page.find_tables().tables if TABLE_MARKER in page.get_text() else []
+    table_rects = [pymupdf.Rect(table.bbox) for table in tables]
+
+    parts = []
+    for block in page.get_text("blocks", sort=True):
+        rect = pymupdf.Rect(block[:4])
+        # Skip text that is rendered as part of a table below
+        if any(rect.intersects(table_rect) for table_rect in table_rects):
+            continue
+        parts.append(block[4].strip())
+    for table in tables:
+        parts.append(table.to_markdown().strip())
+    return "\n".join(part for part in parts if part)
+
+
+def extract_declaration_text(pdf_path):
+    # Returns the text of the declaration page by page, a PDF with only the pages that
+    # have no usable text layer (None if every page has text) and the number of such pages
+    with metrics.timer("text", mp=Path(pdf_path).stem) as event:
+        text, scanned_pdf, scanned_count = _extract_declaration_text(pdf_path)
+        event["scanned_pages"] = scanned_count
+    return text, scanned_pdf, scanned_count
+
+
+def _extract_declaration_text(pdf_path):
+    sections = []
+    scanned_pages = []
+    with pymupdf.open(pdf_path) as doc:
+        for i, page in enumerate(doc):
+            text = page_to_text(page)
+            if len("".join(text.split())) < MIN_TEXT_CHARS:
+                scanned_pages.append(i)
+                sections.append(f"--- {i + 1}. oldal ---\n[Nincs szövegréteg, lásd a csatolt PDF-et]")
+            else:
+                sections.append(f"--- {i + 1}. oldal ---\n{text}")
+
+        scanned_pdf = None
+        if scanned_pages:
+            with pymupdf.open() as scanned_doc:
+                for i in scanned_pages:
+                    scanned_doc.insert_pdf(doc, from_page=i, to_page=i)
+                scanned_pdf = scanned_doc.tobytes(garbage=3, deflate=True)
+
+    return "\n\n".join(sections), scanned_pdf, len(scanned_pages)
+
+
+# Parts a long declaration is extracted in: (name, heading line the part starts with, schema fields
+# it holds). The first part starts on the first page, which has the declarant's name. A part whose
+# heading is not found is merged into the part before it.
+DECLARATION_SECTIONS = [
+    ("ingatlanok", None, ["nyilatkozattevo_nev", "vagyonyi_nyilatkozat.ingatlanok"]),
+    (
+        "ingosagok",
+        "II. Nagy értékű",
+        [
+            "vagyonyi_nyilatkozat.nagy_erteku_ingok",
+            "vagyonyi_nyilatkozat.tartozasok",
+            "vagyonyi_nyilatkozat.egyeb_kozlendok",
+        ],
+    ),
+    ("jovedelem", "JÖVEDELEMNYILATKOZAT", ["jovedelemnyilatkozat"]),
+    ("gazdasagi", "GAZDASÁGI ÉRDEKELTSÉGI NYILATKOZAT", ["gazdasagi_erdekeltsegi_nyilatkozat"]),
+]
+
+
+# A property of the list starts with a line like "3. Ingatlan:"
+PROPERTY_START_PATTERN = re.compile(r"\d+\. Ingatlan:")
+PROPERTY_FIELD = "vagyonyi_nyilatkozat.ingatlanok"
+
+
+def find_heading(doc, heading, first_page):
+    # (page, whether the heading is the first text on the page) of the first line starting with heading
+    for i in range(first_page, doc.page_count):
+        for block_index, block in enumerate(doc[i].get_text("blocks", sort=True)):
+            for line_index, line in enumerate(block[4].splitlines()):
+                if line.strip().startswith(heading):
+                    return i, block_index == 0 and line_index == 0
+    return None
+
+
+def starts_with_property(page):
+    blocks = page.get_text("blocks", sort=True)
+    return bool(blocks) and PROPERTY_START_PATTERN.match(blocks[0][4].lstrip()) is not None
+
+
+def split_property_pages(doc, start_page, end_page, max_pages):
+    # Pages where a long property list can be cut into parts of at most max_pages pages:
+    # only before a page that starts with a new property, so no property is split in two
+    cuts = []
+    part_start = start_page
+    candidate = None
+    for i in range(start_page + 1, end_page):
+        if starts_with_property(doc[i]):
+            candidate = i
+        if i + 1 - part_start > max_pages and candidate is not None and candidate > part_start:
+            cuts.append(candidate)
+            part_start = candidate
+    return cuts
+
+
+def find_sections(pdf_path, max_pages=None):
+    # [(name, fields, first page, end page)] of the parts of a declaration. A page on which a
+    # heading starts below other text belongs to both parts around it. With max_pages, the
+    # property list is also cut into parts of about that many pages (ingatlanok_2, ...).
+    sections = []
+    with pymupdf.open(pdf_path) as doc:
+        for name, heading, fields in DECLARATION_SECTIONS:
+            if heading is None:
+                sections.append([name, list(fields), 0, doc.page_count])
+                continue
+            found = find_heading(doc, heading, sections[-1][2])
+            if found is None:
+                sections[-1][1].extend(fields)
+                continue
+            page, at_top = found
+            sections[-1][3] = page if at_top else page + 1
+            sections.append([name, list(fields), page, doc.page_count])
+
+        first = sections[0]
+        if max_pages and first[3] - first[2] > max_pages:
+            cuts = split_property_pages(doc, first[2], first[3], max_pages)
+            bounds = [first[2]] + cuts + [first[3]]
+            parts = [[first[0], first[1], bounds[0], bounds[1]]]
+            for number, (start_page, end_page) in enumerate(zip(bounds[1:], bounds[2:]), start=2):
+                parts.append([f"{first[0]}_{number}", [PROPERTY_FIELD], start_page, end_page])
+            sections[:1] = parts
+    return [tuple(section) for section in sections]
+
+
+def write_section_pdfs(pdf_path, sections, output_dir):
+    # Write each part to <output_dir>/<mp>.<part>.pdf; returns [(name, fields, path)]
+    os.makedirs(output_dir, exist_ok=True)
+    stem = Path(pdf_path).stem
+    parts = []
+    with pymupdf.open(pdf_path) as doc:
+        for name, fields, start_page, end_page in sections:
+            section_path = os.path.join(output_dir, f"{stem}.{name}.pdf")
+            with pymupdf.open() as section_doc:
+                section_doc.insert_pdf(doc, from_page=start_page, to_page=end_page - 1)
+                section_doc.save(section_path, garbage=3, deflate=True)
+            parts.append((name, fields, section_path))
+    return parts
@@ -0,0 +1,259 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+from aggregates import get_path, mp_aggregates
+from export import COMPACT, compact_number
+from index import fold
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Filter operators: ?osszvagyon_huf.gte=100000000
+OPERATORS = {
+    "eq": lambda value, bound: value == bound,
+    "gte": lambda value, bound: value >= bound,
+    "gt": lambda value, bound: value > bound,
+    "lte": lambda value, bound: value <= bound,
+    "lt": lambda value, bound: value < bound,
+}
+
+YEAR_PATTERN = re.compile(r"\d{4}")
+
+# Responses kept in memory, by request
+RESPONSE_CACHE_SIZE = 256
+
+
+def latest_year(items, key):
+    # Latest year in a field of a list of items (a year or a date such as "2024-12-05"), or None
+    years = []
+    for item in items or []:
+        value = item.get(key) if isinstance(item, dict) else None
+        if isinstance(value, int) and not isinstance(value, bool):
+            years.append(value)
+        elif isinstance(value, str):
+            match = YEAR_PATTERN.match(value.strip())
+            if match:
+                years.append(int(match.group()))
+    return max(years) if years else None
+
+
+def mp_row(mp):
+    # The aggregates of export.py plus the latest vehicle years, for filters such as
+    # "MPs with a vehicle acquired after 2023"
+    vehicles = get_path(mp, "vagyonyi_nyilatkozat", "nagy_erteku_ingok", "gepjarmuvek")
+    return {
+        **{key: compact_number(value) for key, value in mp_aggregates(mp).items()},
+        "gepjarmu_gyartasi_ev_max": latest_year(vehicles, "gyartasi_ev"),
+        "gepjarmu_szerzes_ev_max": latest_year(vehicles, "szerzes_datuma"),
+    }
+
+
+class QueryError(Exception):
+    pass
+
+
+class Dataset:
+    # The combined declarations loaded once: one row of precomputed aggregates per MP, the
+    # MPs by source_file, and the row order sorted by every column, so a sorted, filtered page
+    # is a walk over a presorted list
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            raw = f.read()
+        # Part of every ETag, so cached responses are invalidated when the data changes
+        self.version = hashlib.sha256(raw).hexdigest()[:16]
+        mps = json.loads(raw)
+        self.rows = [mp_row(mp) for mp in mps]
+        self.columns = list(self.rows[0]) if self.rows else []
+        self.by_source_file = {mp.get("source_file"): (mp, row) for mp, row in zip(mps, self.rows)}
+        self.folded_names = [fold(row["nyilatkozattevo_nev"] or "") for row in self.rows]
+        self.sorted_rows = {}
+        for column in self.columns:
+            # Missing values sort last in both directions
+            present = [i for i, row in enumerate(self.rows) if row[column] is not None]
+            missing = [i for i, row in enumerate(self.rows) if row[column] is None]
+            ascending = sorted(present, key=lambda i: (self.rows[i][column], i))
+            descending = sorted(present, key=lambda i: (self.rows[i][column], -i), reverse=True)
+            self.sorted_rows[column] = (ascending + missing, descending + missing)
+
+    def parse_value(self, column, text):
+        sample = next((row[column] for row in self.rows if row[column] is not None), None)
+        if isinstance(sample, (int, float)):
+            try:
+                return float(text) if "." in text else int(text)
+            except ValueError:
+                raise QueryError(f"{column} needs a number, got {text!r}")
+        return text
+
+    def query(self, params):
+        # {"total", "offset", "limit", "mps"} of a list request; params are the query string pairs
+        sort = "source_file"
+        descending = False
+        limit = DEFAULT_LIMIT
+        offset = 0
+        name = None
+        filters = []
+        for key, text in params:
+            if key == "sort":
+                descending = text.startswith("-")
+                sort = text.lstrip("-")
+                if sort not in self.sorted_rows:
+                    raise QueryError(f"Unknown sort column {sort!r}")
+            elif key in ("limit", "offset"):
+                if not text.isdigit():
+                    raise QueryError(f"{key} needs a non-negative integer")
+                if key == "limit":
+                    limit = min(int(text), MAX_LIMIT)
+                else:
+                    offset = int(text)
+            elif key == "q":
+                name = fold(text)
+            else:
+                column, _, operator = key.rpartition(".")
+                if not column:
+                    column, operator = key, "eq"
+                if column not in self.sorted_rows or operator not in OPERATORS:
+                    raise QueryError(f"Unknown filter {key!r}")
+                filters.append((column, OPERATORS[operator], self.parse_value(column, text)))
+
+        order = self.sorted_rows[sort][1 if descending else 0]
+        matches = [
+            i
+            for i in order
+            if (name is None or name in self.folded_names[i])
+            and all(
+                self.rows[i][column] is not None and compare(self.rows[i][column], bound)
+                for column, compare, bound in filters
+            )
+        ]
+        return {
+            "total": len(matches),
+            "offset": offset,
+            "limit": limit,
+            "mps": [self.rows[i] for i in matches[offset:offset + limit]],
+        }
+
+    def detail(self, source_file):
+        # Full declaration of an MP with its aggregates, or None
+        found = self.by_source_file.get(source_file)
+        if found is None:
+            return None
+        mp, row = found
+        return {**mp, "aggregates": row}
+
+
+class ResponseCache:
+    # Bodies of recent responses by request, least recently used evicted first
+    def __init__(self, size=RESPONSE_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        with self.lock:
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # GET /mps?sort=-tartozas_huf&limit=20, GET /mps/mp_004 and GET / (the columns). The
+    # ETag of a response is derived from the dataset version and the request, so a matching
+    # If-None-Match is answered with 304 without running the query.
+    dataset = None
+    cache = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = sorted(parse_qsl(url.query, keep_blank_values=True))
+        request_key = url.path.rstrip("/") + "?" + "&".join(f"{key}={value}" for key, value in params)
+        etag = f'"{self.dataset.version}-{hashlib.sha256(request_key.encode()).hexdigest()[:16]}"'
+
+        if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        body = self.cache.get(request_key)
+        if body is None:
+            try:
+                data = self.route(url.path.rstrip("/"), params)
+            except QueryError as e:
+                self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+                return
+            if data is None:
+                self.send_json(HTTPStatus.NOT_FOUND, {"error": f"Not found: {url.path}"})
+                return
+            body = json.dumps(data, **COMPACT).encode("utf-8")
+            self.cache.put(request_key, body)
+        self.send_json(HTTPStatus.OK, body, etag)
+
+    def route(self, path, params):
+        if path == "":
+            return {"version": self.dataset.version, "count": len(self.dataset.rows), "columns": self.dataset.columns}
+        if path == "/mps":
+            return self.dataset.query(params)
+        if path.startswith("/mps/"):
+            return self.dataset.detail(path[len("/mps/"):])
+        return None
+
+    def send_json(self, status, data, etag=None):
+        body = data if isinstance(data, bytes) else json.dumps(data, **COMPACT).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+            # Clients may keep the response but must revalidate it, which is a 304 while the data is unchanged
+            self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_server(input_path, host="127.0.0.1", port=8000):
+    QueryHandler.dataset = Dataset(input_path)
+    QueryHandler.cache = ResponseCache()
+    return ThreadingHTTPServer((host, port), QueryHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve sorted, filtered and paginated queries over the combined declarations as a read-only JSON API"
+    )
+    parser.add_argument(
+        "--input",
+        default=os.path.join("jsons", "combined.json"),
+        help="Combined JSON to serve (default: jsons/combined.json)",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    args = parser.parse_args()
+
+    server = create_server(args.input, args.host, args.port)
+    print(
+        f"🌐 Serving {len(QueryHandler.dataset.rows)} MPs from {args.input} "
+        f"on http://{args.host}:{args.port} (dataset version {QueryHandler.dataset.version})"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
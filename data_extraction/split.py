@@ -1,83 +1,404 @@
 import os
 import sys
+import json
+import time
+import hashlib
+import itertools
 import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from PyPDF2 import PdfReader, PdfWriter
 
-def extract_mp_page_numbers(pdf_path):
-    # Load the PDF file
-    pdf_reader = PdfReader(pdf_path)
-    
-    # Define the phrase indicating the start of a new MP's declaration
-    search_text = "Az Országgyűlésről szóló 2012. évi XXXVI. törvény 1. melléklete alapján"
-    
-    # Find the page numbers where a new MP's declaration starts
+from metrics import metrics
+
+# PyMuPDF is optional; page scanning falls back to PyPDF2 without it
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+# Define the phrase indicating the start of a new MP's declaration
+MP_START_TEXT = "Az Országgyűlésről szóló 2012. évi XXXVI. törvény 1. melléklete alapján"
+
+# The phrase is the first text block of a declaration, so only the top of each page has to be scanned
+HEADER_REGION_RATIO = 0.3
+
+# Content hash of every sub-PDF, written next to them. The leading dot keeps it out of the mp_*.pdf glob.
+SPLIT_MANIFEST_NAME = ".split_manifest.json"
+
+def scan_pages_with_pymupdf(pdf_path, full_text=False, start_page=0, end_page=None):
+    # Find the 0-based pages whose header (or whole text) contains the start phrase
+    new_mp_pages = []
+    with pymupdf.open(pdf_path) as doc:
+        end_page = doc.page_count if end_page is None else min(end_page, doc.page_count)
+        for i in range(start_page, end_page):
+            if page_starts_declaration(doc[i], full_text):
+                new_mp_pages.append(i)
+    return new_mp_pages
+
+def page_starts_declaration(page, full_text=False):
+    clip = None
+    if not full_text:
+        rect = page.rect
+        clip = pymupdf.Rect(rect.x0, rect.y0, rect.x1, rect.y0 + rect.height * HEADER_REGION_RATIO)
+    return MP_START_TEXT in page.get_text("text", clip=clip)
+
+def scan_pages_with_pypdf2(pdf_reader, start_page=0, end_page=None):
+    # PyPDF2 cannot extract a region of a page, so every page gets a full text pass
+    if not isinstance(pdf_reader, PdfReader):
+        pdf_reader = PdfReader(pdf_reader)
+    pages = pdf_reader.pages
+    end_page = len(pages) if end_page is None else min(end_page, len(pages))
     new_mp_pages = []
-    for i, page in enumerate(pdf_reader.pages):
-        if search_text in page.extract_text():
-            new_mp_pages.append(i)  # 0-based page numbers for processing
+    for i in range(start_page, end_page):
+        if MP_START_TEXT in pages[i].extract_text():
+            new_mp_pages.append(i)
+    return new_mp_pages
+
+def use_pymupdf(backend):
+    if backend == "pymupdf" and pymupdf is None:
+        raise RuntimeError("PyMuPDF is not installed. Please install it with: pip install PyMuPDF")
+    return backend in ("auto", "pymupdf") and pymupdf is not None
+
+def scan_page_range(pdf_path, start_page, end_page, backend="auto", full_text=False):
+    # Worker entry point: each process opens the PDF itself and scans its own chunk of pages
+    if use_pymupdf(backend):
+        return scan_pages_with_pymupdf(pdf_path, full_text, start_page, end_page)
+    return scan_pages_with_pypdf2(pdf_path, start_page, end_page)
+
+def split_range(total, parts):
+    # Divide range(total) into at most `parts` contiguous (start, end) chunks of near-equal size
+    parts = max(1, min(parts, total))
+    size, extra = divmod(total, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+def extract_mp_page_numbers(pdf_path, pdf_reader=None, backend="auto", full_text=False, workers=1):
+    if workers > 1:
+        # Scan chunks of the page range in a process pool and merge them in page order
+        if use_pymupdf(backend):
+            with pymupdf.open(pdf_path) as doc:
+                total_pages = doc.page_count
+        else:
+            total_pages = len((pdf_reader or PdfReader(pdf_path)).pages)
+        chunks = split_range(total_pages, workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(scan_page_range, pdf_path, start, end, backend, full_text)
+                for start, end in chunks
+            ]
+            new_mp_pages = [page for future in futures for page in future.result()]
+    elif use_pymupdf(backend):
+        # Prefer PyMuPDF, which can extract just the header region of each page
+        new_mp_pages = scan_pages_with_pymupdf(pdf_path, full_text)
+    else:
+        # Fall back to PyPDF2, reusing the already parsed reader if there is one
+        new_mp_pages = scan_pages_with_pypdf2(pdf_reader or PdfReader(pdf_path))
     
     print(f"Found {len(new_mp_pages)} MP declarations starting on pages: {[p+1 for p in new_mp_pages]}")
     return new_mp_pages
 
-def create_sub_pdf(pdf_path, start_page, end_page, output_path):
+def page_hash_with_pymupdf(doc, page):
+    # SHA-256 of the page's decoded content stream and the raw bytes of its images
+    # (decoding the scanned page images would take most of the split's time)
+    digest = hashlib.sha256(page.read_contents())
+    for image in page.get_images(full=True):
+        digest.update(doc.xref_stream_raw(image[0]) or b"")
+    return digest.hexdigest()
+
+def page_hashes_with_pymupdf(pdf_path):
+    with pymupdf.open(pdf_path) as doc:
+        return [page_hash_with_pymupdf(doc, page) for page in doc]
+
+def page_hashes_with_pypdf2(pdf_reader):
+    hashes = []
+    for page in pdf_reader.pages:
+        contents = page.get_contents()
+        digest = hashlib.sha256(contents.get_data() if contents else b"")
+        resources = page.get("/Resources")
+        xobjects = resources.get_object().get("/XObject") if resources else None
+        for name in sorted(xobjects.get_object()) if xobjects else []:
+            xobject = xobjects.get_object()[name].get_object()
+            if xobject.get("/Subtype") == "/Image":
+                digest.update(xobject._data)
+        hashes.append(digest.hexdigest())
+    return hashes
+
+def mp_content_hash(page_hashes, start_page, end_page):
+    # Stable across re-saves of the gazette: only the pages' content counts, not object numbers or compression
+    return hashlib.sha256("".join(page_hashes[start_page:end_page]).encode("ascii")).hexdigest()
+
+def sub_pdf_content_hash(pdf_path, backend="auto"):
+    # Content hash of an existing sub-PDF, equal to the mp_content_hash of its pages in the
+    # gazette whichever mode wrote it; None if the file can't be read
+    try:
+        if use_pymupdf(backend):
+            page_hashes = page_hashes_with_pymupdf(pdf_path)
+        else:
+            page_hashes = page_hashes_with_pypdf2(PdfReader(pdf_path))
+    except Exception:
+        return None
+    return mp_content_hash(page_hashes, 0, len(page_hashes))
+
+def is_unchanged(sub_pdf_path, content_hash, previous, backend="auto"):
+    # Whether the sub-PDF on disk already holds these pages. Without a manifest entry (a first
+    # split with this manifest, or a restored temp/) the file itself is hashed, so unchanged
+    # sub-PDFs are kept with their mtime instead of being rewritten.
+    if not os.path.exists(sub_pdf_path):
+        return False
+    if previous:
+        return previous["sha256"] == content_hash
+    return sub_pdf_content_hash(sub_pdf_path, backend) == content_hash
+
+def load_split_manifest(output_dir="./temp"):
+    try:
+        with open(os.path.join(output_dir, SPLIT_MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def create_sub_pdf(pdf_reader, start_page, end_page, output_path):
     pdf_writer = PdfWriter()
-    pdf_reader = PdfReader(pdf_path)
+    # Passing a path instead of a reader re-parses the master PDF (legacy behaviour)
+    if not isinstance(pdf_reader, PdfReader):
+        pdf_reader = PdfReader(pdf_reader)
+    pages = pdf_reader.pages
     
-    # Add all pages in the range
-    for page_num in range(start_page, end_page):
-        if page_num < len(pdf_reader.pages):
-            pdf_writer.add_page(pdf_reader.pages[page_num])
+    # Add all pages in the range, sharing the parsed page objects of the master PDF
+    for page_num in range(start_page, min(end_page, len(pages))):
+        pdf_writer.add_page(pages[page_num])
     
-    # Save the output PDF
+    # Stream the output PDF to disk
     with open(output_path, "wb") as out_file:
         pdf_writer.write(out_file)
 
-def split_pdf(pdf_path, limit=None):
-    # Create temp directory if it doesn't exist
-    os.makedirs("./temp", exist_ok=True)
+def create_sub_pdfs(pdf_path, jobs):
+    # Worker entry point: parse the master PDF once per process and write a batch of sub-PDFs
+    pdf_reader = PdfReader(pdf_path)
+    for start_page, end_page, output_path in jobs:
+        create_sub_pdf(pdf_reader, start_page, end_page, output_path)
+    return len(jobs)
+
+def split_pdf(pdf_path, limit=None, output_dir="./temp", backend="auto", full_text=False, workers=1, full=False):
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # Parse the master PDF once and share it across every stage
+    pdf_reader = PdfReader(pdf_path)
+    total_pages = len(pdf_reader.pages)
     
     # Get the page numbers for each MP
-    mp_pages = extract_mp_page_numbers(pdf_path)
+    with metrics.timer("scan", pages=total_pages):
+        mp_pages = extract_mp_page_numbers(pdf_path, pdf_reader, backend, full_text, workers)
     
     # Limit the number of MPs to process if specified
     if limit:
         mp_pages = mp_pages[:limit]
     
-    # Create a list to store the output paths
+    # Hash the content of every page, to skip sub-PDFs whose pages did not change
+    with metrics.timer("hash", pages=total_pages):
+        if use_pymupdf(backend):
+            page_hashes = page_hashes_with_pymupdf(pdf_path)
+        else:
+            page_hashes = page_hashes_with_pypdf2(pdf_reader)
+    previous_manifest = load_split_manifest(output_dir)
+    previous_mps = previous_manifest["mps"] if previous_manifest else {}
+    manifest_mps = dict(previous_mps)
+    changed = []
+    
+    # Create a list to store the output paths and the (start, end, path) of each sub-PDF
     output_paths = []
+    jobs = []
     
     # Process MPs
     for i, start_page in enumerate(mp_pages):
         # Determine end page (either next MP or end of PDF)
-        end_page = mp_pages[i+1] if i+1 < len(mp_pages) else None
+        end_page = mp_pages[i+1] if i+1 < len(mp_pages) else total_pages
         
         # Create output path for sub-PDF with 3-digit padding
-        sub_pdf_path = f"./temp/mp_{i+1:03d}.pdf"
+        file_name = f"mp_{i+1:03d}.pdf"
+        sub_pdf_path = os.path.join(output_dir, file_name)
         output_paths.append(sub_pdf_path)
         
-        print(f"Processing MP {i+1} (pages {start_page+1} to {end_page if end_page is None else end_page})")
+        content_hash = mp_content_hash(page_hashes, start_page, end_page)
+        previous = previous_mps.get(file_name)
+        manifest_mps[file_name] = {"pages": [start_page, end_page], "sha256": content_hash}
+        if not full and is_unchanged(sub_pdf_path, content_hash, previous, backend):
+            # Same pages as last time: keep the file and its mtime
+            continue
+        if previous_manifest:
+            changed.append(file_name)
+        jobs.append((start_page, end_page, sub_pdf_path))
         
-        # Create sub-PDF for this MP
-        create_sub_pdf(
-            pdf_path, 
-            start_page, 
-            end_page if end_page is not None else len(PdfReader(pdf_path).pages), 
-            sub_pdf_path
-        )
+        print(f"Processing MP {i+1} (pages {start_page+1} to {end_page})")
+        
+        if workers <= 1:
+            # Create sub-PDF for this MP from the shared reader
+            with metrics.timer("write", mp=file_name[:-4], pages=end_page - start_page):
+                create_sub_pdf(pdf_reader, start_page, end_page, sub_pdf_path)
+    
+    if workers > 1 and jobs:
+        # Spread the MPs over the workers; each one parses the master PDF once
+        with ProcessPoolExecutor(max_workers=workers) as executor, metrics.timer("write", mps=len(jobs)):
+            batches = [jobs[i::workers] for i in range(min(workers, len(jobs)))]
+            futures = [executor.submit(create_sub_pdfs, pdf_path, batch) for batch in batches]
+            for future in futures:
+                future.result()
+    
+    finish_split(pdf_path, output_dir, limit, output_paths, manifest_mps, previous_manifest, changed, len(jobs))
+    return output_paths
+
+def finish_split(pdf_path, output_dir, limit, output_paths, manifest_mps, previous_manifest, changed, written_count):
+    # MPs that were in the previous split but are gone from this gazette
+    removed = []
+    if not limit:
+        for file_name in sorted(set(manifest_mps) - {os.path.basename(path) for path in output_paths}):
+            del manifest_mps[file_name]
+            stale_path = os.path.join(output_dir, file_name)
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+            removed.append(file_name)
+    
+    # "changed" lists the sub-PDFs whose content differs from the previous split. extract.py
+    # doesn't rely on it, since it only covers one run: it compares the "sha256" of each MP with
+    # the one its JSON was extracted from
+    manifest = {"source": pdf_path, "mps": dict(sorted(manifest_mps.items())), "changed": changed, "removed": removed}
+    with open(os.path.join(output_dir, SPLIT_MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
     
+    metrics.count("sub_pdfs_written", written_count)
+    metrics.count("sub_pdfs_unchanged", len(output_paths) - written_count)
+    print(f"Wrote {written_count} sub-PDFs, {len(output_paths) - written_count} unchanged")
+    if previous_manifest:
+        shown = ", ".join(changed[:20]) + (", ..." if len(changed) > 20 else "")
+        print(f"{len(changed)} changed MPs: {shown or 'none'}" + (f"; removed: {', '.join(removed)}" if removed else ""))
+
+def iter_declarations_with_pymupdf(doc, full_text=False):
+    # Yield (start page, end page, page hashes) of each declaration as soon as the next one starts.
+    # Pages are loaded one at a time, so only the current declaration's page hashes are held.
+    start_page, page_hashes = None, []
+    for i, page in enumerate(doc):
+        if page_starts_declaration(page, full_text):
+            if start_page is not None:
+                yield start_page, i, page_hashes
+            start_page, page_hashes = i, []
+        if start_page is not None:
+            page_hashes.append(page_hash_with_pymupdf(doc, page))
+    if start_page is not None:
+        yield start_page, doc.page_count, page_hashes
+
+def split_pdf_streaming(pdf_path, limit=None, output_dir="./temp", full_text=False, full=False):
+    # Memory-bounded split: scan, hash and write one declaration at a time with PyMuPDF,
+    # instead of holding the parsed page tree of the whole gazette in PyPDF2
+    if pymupdf is None:
+        raise RuntimeError("Streaming mode needs PyMuPDF. Please install it with: pip install PyMuPDF")
+    os.makedirs(output_dir, exist_ok=True)
+    previous_manifest = load_split_manifest(output_dir)
+    previous_mps = previous_manifest["mps"] if previous_manifest else {}
+    manifest_mps = dict(previous_mps)
+    changed = []
+    output_paths = []
+    written_count = 0
+    
+    with pymupdf.open(pdf_path) as doc:
+        declarations = iter_declarations_with_pymupdf(doc, full_text)
+        for i in itertools.count():
+            if limit and i >= limit:
+                break
+            # Scanning and hashing happen page by page inside the generator
+            with metrics.timer("scan", mp=f"mp_{i+1:03d}") as event:
+                start_page, end_page, page_hashes = next(declarations, (None, None, None))
+                event["pages"] = len(page_hashes or [])
+            if start_page is None:
+                break
+            # Drop MuPDF's cache of parsed objects, otherwise it grows up to its 256 MB limit
+            pymupdf.TOOLS.store_shrink(100)
+            file_name = f"mp_{i+1:03d}.pdf"
+            sub_pdf_path = os.path.join(output_dir, file_name)
+            output_paths.append(sub_pdf_path)
+            
+            # Same hash as the default mode, so both modes share the manifest
+            content_hash = mp_content_hash(page_hashes, 0, len(page_hashes))
+            previous = previous_mps.get(file_name)
+            manifest_mps[file_name] = {"pages": [start_page, end_page], "sha256": content_hash}
+            if not full and is_unchanged(sub_pdf_path, content_hash, previous, "pymupdf"):
+                continue
+            if previous_manifest:
+                changed.append(file_name)
+            
+            print(f"Processing MP {i+1} (pages {start_page+1} to {end_page})")
+            with metrics.timer("write", mp=file_name[:-4], pages=end_page - start_page), pymupdf.open() as sub_doc:
+                sub_doc.insert_pdf(doc, from_page=start_page, to_page=end_page - 1)
+                sub_doc.save(sub_pdf_path, garbage=3, deflate=True)
+            written_count += 1
+    
+    finish_split(pdf_path, output_dir, limit, output_paths, manifest_mps, previous_manifest, changed, written_count)
     return output_paths
 
+def benchmark_split(pdf_path, limit=None, backend="auto", full_text=False):
+    # Detect the MP boundaries once so both paths write the same sub-PDFs
+    mp_pages = extract_mp_page_numbers(pdf_path, backend=backend, full_text=full_text)
+    if limit:
+        mp_pages = mp_pages[:limit]
+    
+    with tempfile.TemporaryDirectory() as legacy_dir, tempfile.TemporaryDirectory() as single_pass_dir:
+        # Legacy path: re-parse the master PDF for every MP (and for the page count of the last one)
+        start = time.perf_counter()
+        for i, start_page in enumerate(mp_pages):
+            end_page = mp_pages[i+1] if i+1 < len(mp_pages) else len(PdfReader(pdf_path).pages)
+            create_sub_pdf(pdf_path, start_page, end_page, os.path.join(legacy_dir, f"mp_{i+1:03d}.pdf"))
+        legacy_seconds = time.perf_counter() - start
+        
+        # Single-pass path: parse once, share page objects across all writers
+        start = time.perf_counter()
+        pdf_reader = PdfReader(pdf_path)
+        total_pages = len(pdf_reader.pages)
+        for i, start_page in enumerate(mp_pages):
+            end_page = mp_pages[i+1] if i+1 < len(mp_pages) else total_pages
+            create_sub_pdf(pdf_reader, start_page, end_page, os.path.join(single_pass_dir, f"mp_{i+1:03d}.pdf"))
+        single_pass_seconds = time.perf_counter() - start
+    
+    print(f"Legacy splitter (re-parse per MP): {legacy_seconds:.2f}s")
+    print(f"Single-pass splitter:              {single_pass_seconds:.2f}s")
+    print(f"Speedup: {legacy_seconds / single_pass_seconds:.1f}x for {len(mp_pages)} MPs")
+
 def main():
     # Configure the parser
     parser = argparse.ArgumentParser(description='Split MP declarations into separate PDFs')
     parser.add_argument('--limit', type=int, help='Limit the number of MPs to process')
+    parser.add_argument('--pdf', default="./pdfs/Kepviselok_20250228.pdf", help='Path of the master PDF to split')
+    parser.add_argument('--benchmark', action='store_true', help='Compare the single-pass splitter against re-parsing the PDF for every MP')
+    parser.add_argument('--backend', choices=['auto', 'pymupdf', 'pypdf2'], default='auto', help='Page scanning backend (default: PyMuPDF if installed, otherwise PyPDF2)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to scan pages and write sub-PDFs (default: 1)')
+    parser.add_argument('--full-text', action='store_true', help='Search the whole page text for the declaration header instead of only the top of the page')
+    parser.add_argument('--full', action='store_true', help='Rewrite every sub-PDF, even if its pages did not change since the last split')
+    parser.add_argument('--metrics', metavar='PATH', help='Write per-stage timings (page scan, hashing, sub-PDF writes) to PATH')
+    parser.add_argument('--metrics-format', choices=['jsonl', 'prometheus'], default='jsonl', help='jsonl appends one event per timed stage as it happens; prometheus writes a text exposition at the end (default: jsonl)')
+    parser.add_argument('--streaming', action='store_true', help='Scan and write one declaration at a time with PyMuPDF, so memory use does not grow with the gazette')
     args = parser.parse_args()
+    if args.metrics:
+        metrics.configure(args.metrics, args.metrics_format)
+    
+    if args.benchmark:
+        benchmark_split(args.pdf, args.limit, args.backend, args.full_text)
+        return
     
     # Split the PDF
-    pdf_path = "./pdfs/Kepviselok_20250228.pdf"
-    output_paths = split_pdf(pdf_path, args.limit)
+    if args.streaming:
+        output_paths = split_pdf_streaming(args.pdf, args.limit, full_text=args.full_text, full=args.full)
+    else:
+        output_paths = split_pdf(args.pdf, args.limit, backend=args.backend, full_text=args.full_text, workers=args.workers, full=args.full)
     print(f"Created {len(output_paths)} individual PDF files in ./temp/")
+    metrics.finish()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from cache import file_lock, file_sha256
+from metrics import metrics
+
+# Gemini keeps uploaded files for 48 hours; don't reuse a handle that is about to expire
+UPLOAD_LIFETIME = timedelta(hours=48)
+EXPIRY_MARGIN = timedelta(hours=1)
+
+
+class MockUploadAPI:
+    # Local stand-in for the genai upload_file/get_file API with artificial latency
+    def __init__(self, latency=0.5):
+        self.latency = latency
+        self.files = {}
+        self.upload_count = 0
+        self.lock = threading.Lock()
+
+    def upload_file(self, path):
+        time.sleep(self.latency)
+        with self.lock:
+            self.upload_count += 1
+            name = f"files/mock-{self.upload_count:06d}"
+            self.files[name] = SimpleNamespace(
+                name=name,
+                display_name=os.path.basename(path),
+                expiration_time=datetime.now(timezone.utc) + UPLOAD_LIFETIME,
+            )
+            return self.files[name]
+
+    def get_file(self, name):
+        with self.lock:
+            if name not in self.files:
+                raise FileNotFoundError(f"{name} does not exist")
+            return self.files[name]
+
+
+class UploadRegistry:
+    # Maps PDF content hashes to uploaded file handles so unchanged PDFs are uploaded only once.
+    # Uploads can be prefetched in the background so they overlap with generate calls.
+    def __init__(self, upload_api, registry_path=None, upload_concurrency=4, call_with_retries=None):
+        self.upload_api = upload_api
+        self.registry_path = registry_path
+        self.call_with_retries = call_with_retries or (lambda function: function())
+        self.lock = threading.Lock()
+        self.entries = self._load()
+        self.futures = {}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, upload_concurrency))
+
+    def _load(self):
+        if not self.registry_path or not os.path.exists(self.registry_path):
+            return {}
+        try:
+            with open(self.registry_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            return {}
+
+    def _save(self):
+        # Other worker processes may share the registry file (extract.py --queue): under a file
+        # lock, merge their entries in, keeping the handle that expires last, so no process
+        # drops another's uploads
+        if not self.registry_path:
+            return
+        os.makedirs(os.path.dirname(self.registry_path) or ".", exist_ok=True)
+        with file_lock(f"{self.registry_path}.lock"):
+            for content_hash, entry in self._load().items():
+                current = self.entries.get(content_hash)
+                if current is None or datetime.fromisoformat(entry["expires"]) > datetime.fromisoformat(current["expires"]):
+                    self.entries[content_hash] = entry
+            tmp_path = f"{self.registry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.registry_path)
+
+    def _live_handle(self, content_hash):
+        # Return the remote file for this content if it is known and not about to expire
+        with self.lock:
+            entry = self.entries.get(content_hash)
+        if not entry:
+            return None
+        expires = datetime.fromisoformat(entry["expires"])
+        if expires - EXPIRY_MARGIN <= datetime.now(timezone.utc):
+            return None
+        try:
+            return self.call_with_retries(lambda: self.upload_api.get_file(entry["name"]))
+        except Exception:
+            # Deleted or otherwise gone on the server side; upload again
+            return None
+
+    def _upload(self, pdf_path):
+        content_hash = file_sha256(pdf_path)
+        handle = self._live_handle(content_hash)
+        if handle is not None:
+            metrics.count("uploads_reused")
+            return handle
+
+        with metrics.timer("upload", mp=Path(pdf_path).stem, bytes=os.path.getsize(pdf_path)):
+            handle = self.call_with_retries(lambda: self.upload_api.upload_file(pdf_path))
+        expires = getattr(handle, "expiration_time", None) or (
+            datetime.now(timezone.utc) + UPLOAD_LIFETIME
+        )
+        with self.lock:
+            self.entries[content_hash] = {"name": handle.name, "expires": expires.isoformat()}
+            self._save()
+        return handle
+
+    def prefetch(self, pdf_paths):
+        # Start uploading (or looking up) every PDF in the background
+        with self.lock:
+            for pdf_path in pdf_paths:
+                if pdf_path not in self.futures:
+                    self.futures[pdf_path] = self.executor.submit(self._upload, pdf_path)
+
+    def get(self, pdf_path):
+        # Wait for the prefetched upload, or upload now if the PDF was not prefetched
+        self.prefetch([pdf_path])
+        with self.lock:
+            future = self.futures[pdf_path]
+        try:
+            return future.result()
+        finally:
+            # Drop the future so a retried call re-checks the handle instead of reusing a failure
+            if future.exception() is not None:
+                with self.lock:
+                    self.futures.pop(pdf_path, None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)